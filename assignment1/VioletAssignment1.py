@@ -147,11 +147,12 @@ def main():
 
   if s3_client_user:
     #  Find all the objects whose key has the prefix `assignment` and compute the total size of those objects.
-    list_objects=s3_client_user.list_objects_v2(Bucket=bucket_name, Prefix="assignment")
+    paginator = s3_client_user.get_paginator('list_objects_v2')
     total_size_prefix_assignment_object = 0
 
-    for obj in list_objects.get('Contents', []):
-        total_size_prefix_assignment_object += obj['Size']
+    for page in paginator.paginate(Bucket=bucket_name, Prefix="assignment"):
+        for obj in page.get('Contents', []):
+            total_size_prefix_assignment_object += obj['Size']
     print(f"Total size of objects with 'assignment' prefix is {total_size_prefix_assignment_object}!")
         
 
@@ -164,8 +165,9 @@ def main():
   if s3_client_dev_delete:
 
     # delete all the objects inside lecture1
-    objs_to_delete = s3_client_dev_delete.list_objects_v2(Bucket=bucket_name).get('Contents', [])
-    for obj in objs_to_delete:
+    paginator = s3_client_dev_delete.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name):
+      for obj in page.get('Contents', []):
         s3_client_dev_delete.delete_object(Bucket=bucket_name, Key=obj['Key'])
         print(f"{obj['Key']} is deleted!")
 
@@ -1,9 +1,9 @@
-import boto3
+import aws_clients
 import datetime
 
 #initalize s3 and dynamodb clients
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
+s3_client = aws_clients.lazy_client('s3')
+dynamodb_client = aws_clients.lazy_client('dynamodb')
 
 def create_s3_bucket(bucket_name, region='us-west-1'):
     try:
@@ -58,11 +58,13 @@ def calculate_bucket_size_and_number_of_objects(bucket_name):
     try:
         total_size = 0
         total_objects = 0
-        objects = s3_client.list_objects_v2(Bucket=bucket_name)
 
-        for obj in objects.get('Contents', []):
-            total_size += obj['Size']
-            total_objects += 1
+        # follow continuation tokens so buckets with more than 1000 objects are fully counted
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name):
+            for obj in page.get('Contents', []):
+                total_size += obj['Size']
+                total_objects += 1
     
         print(f"Bucket size: {total_size}, Number of objects: {total_objects}")
         return total_size, total_objects
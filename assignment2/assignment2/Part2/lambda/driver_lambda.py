@@ -1,9 +1,9 @@
-import boto3
+import aws_clients
 import time
 import os
 import urllib.request # requests are not supported in cdk
 
-s3 = boto3.client('s3')
+s3 = aws_clients.lazy_client('s3')
 
 bucket_name = os.environ["S3_BUCKET_NAME"]
 
@@ -1,21 +1,30 @@
 # lambda function calculate bucket size and number of objects and store in dynamodb
-import boto3
+import aws_clients
 import datetime
 import os
 
+import batch_writer
+import key_filter
+
 # Initialize the S3 and DynamoDB clients
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
+s3_client = aws_clients.lazy_client('s3')
+dynamodb_client = aws_clients.lazy_client('dynamodb')
 
 def calculate_bucket_size_and_number_of_objects(bucket_name):
     try:
         total_size = 0
         total_objects = 0
-        objects = s3_client.list_objects_v2(Bucket=bucket_name)
 
-        for obj in objects.get('Contents', []):
-            total_size += obj['Size']
-            total_objects += 1
+        # follow continuation tokens so buckets with more than 1000 objects are fully counted
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name):
+            for obj in page.get('Contents', []):
+                # Ignore objects excluded by the key rules, e.g. the "plot/" prefix
+                if not key_filter.is_included(obj['Key']):
+                    continue
+
+                total_size += obj['Size']
+                total_objects += 1
     
         print(f"Bucket size: {total_size}, Number of objects: {total_objects}")
         return total_size, total_objects
@@ -23,7 +32,8 @@ def calculate_bucket_size_and_number_of_objects(bucket_name):
         print(f"Error calculating bucket size and number of objects: {e}")
         return None, None
 
-def store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name):
+def store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, history_writer):
+    table_name = history_writer.table_name
     try:
         # calculation
         bucket_size, number_of_objects = calculate_bucket_size_and_number_of_objects(bucket_name)
@@ -37,36 +47,34 @@ def store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name)
          # Log the data being written to DynamoDB
         print(f"Writing to DynamoDB: bucket_name={bucket_name}, timestamp={timestamp}, bucket_size={bucket_size}, number_of_objects={number_of_objects}")
 
-        # store data in dynamodb
-        dynamodb_client.put_item(
-            TableName=table_name,
-            Item={
-                'bucket_name': {'S': bucket_name},
-                'timestamp': {'S': timestamp},
-                'bucket_size': {'N': str(bucket_size)},
-                'number_of_objects': {'N': str(number_of_objects)}
-            }
-        )
-        print(f"Stored {bucket_name} size and number of objects in {table_name} successfully!")
+        # buffer the row, it is stored in dynamodb when the writer is flushed
+        history_writer.put_item({
+            'bucket_name': {'S': bucket_name},
+            'timestamp': {'S': timestamp},
+            'bucket_size': {'N': str(bucket_size)},
+            'number_of_objects': {'N': str(number_of_objects)}
+        })
     except Exception as e:
         print(f"Error storing {bucket_name} size and number of objects in {table_name}: {e}")
 
 def lambda_handler(event, context):
     table_name = os.environ['TABLE_NAME'] 
 
-    for record in event['Records']:
-        bucket_name = record['s3']['bucket']['name']
-        object_key = record['s3']['object']['key']
+    # rows are written with BatchWriteItem when the handler is done
+    with batch_writer.BatchWriter(table_name, dynamodb_client) as history_writer:
+        for record in event['Records']:
+            bucket_name = record['s3']['bucket']['name']
+            object_key = record['s3']['object']['key']
 
-        # Ignore objects with the "plot/" prefix, so plot will not trigger s3 event
-        if object_key.startswith("plot/"):
-            print(f"Ignoring plot file: {object_key}")
-            continue
-    
-        print(f"Processing object: {object_key} in bucket: {bucket_name}")
+            # Ignore objects excluded by the key rules, so plot will not trigger s3 event
+            if not key_filter.is_included(object_key):
+                print(f"Ignoring excluded object: {object_key}")
+                continue
+        
+            print(f"Processing object: {object_key} in bucket: {bucket_name}")
 
-        # store bucket size and number of objects in dynamodb
-        store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name)
+            # store bucket size and number of objects in dynamodb
+            store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, history_writer)
     
     return {
         'statusCode': 200,
@@ -0,0 +1,89 @@
+# buffered BatchWriteItem writer for dynamodb rows
+import random
+import time
+
+import aws_clients
+import structured_log
+
+logger = structured_log.get_logger('batch_writer')
+
+# BatchWriteItem accepts at most 25 put requests per call
+MAX_BATCH_SIZE = 25
+
+
+class BatchWriter:
+    """
+    Collect items (in low-level attribute value format) and write them to a
+    table with BatchWriteItem in chunks of 25. Items DynamoDB leaves in
+    UnprocessedItems are retried with jittered exponential backoff; items that
+    still cannot be written are collected in failed_items instead of raising.
+
+    Use it as a context manager so the buffer is flushed when the block exits.
+    on_write, if given, is called with the items of every chunk that were
+    written, in the order they were put.
+    """
+
+    def __init__(self, table_name, dynamodb_client=None, max_attempts=8, base_delay=0.05, max_delay=2.0,
+                 on_write=None):
+        self.table_name = table_name
+        self.on_write = on_write
+        self.dynamodb_client = dynamodb_client or aws_clients.client('dynamodb')
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buffer = []
+        self.failed_items = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+    def put_item(self, item):
+        self.buffer.append(item)
+        if len(self.buffer) >= MAX_BATCH_SIZE:
+            self._write_chunk(self.buffer[:MAX_BATCH_SIZE])
+            del self.buffer[:MAX_BATCH_SIZE]
+
+    def flush(self):
+        """
+        Write everything still buffered and return the items that could not be
+        written after all retries (also kept in failed_items).
+        """
+        while self.buffer:
+            self._write_chunk(self.buffer[:MAX_BATCH_SIZE])
+            del self.buffer[:MAX_BATCH_SIZE]
+        return self.failed_items
+
+    def _write_chunk(self, items):
+        request_items = {
+            self.table_name: [{'PutRequest': {'Item': item}} for item in items]
+        }
+        unprocessed = []
+
+        for attempt in range(self.max_attempts):
+            if attempt:
+                # full jitter: sleep a random time up to the exponential backoff cap
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+            try:
+                response = self.dynamodb_client.batch_write_item(RequestItems=request_items)
+            except Exception as e:
+                logger.error("Error writing batch to %s: %s", self.table_name, e)
+                break
+
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                break
+
+        if request_items:
+            unprocessed = [request['PutRequest']['Item'] for request in request_items.get(self.table_name, [])]
+            logger.error("Failed to write %d items to %s", len(unprocessed), self.table_name)
+            self.failed_items.extend(unprocessed)
+
+        if self.on_write:
+            written = [item for item in items if item not in unprocessed]
+            if written:
+                self.on_write(written)
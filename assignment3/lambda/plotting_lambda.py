@@ -1,13 +1,13 @@
 # Plotting lambda function trigger to query dynamodb table and generate plot
 from datetime import datetime, timedelta
 import os
-import boto3
+import aws_clients
 import matplotlib.pyplot as plt
 import numpy as np
 import json
 
-dynamodb = boto3.client("dynamodb")
-s3 = boto3.client("s3")
+dynamodb = aws_clients.lazy_client("dynamodb")
+s3 = aws_clients.lazy_client("s3")
 
 table_name = os.environ['TABLE_NAME'] 
 bucket_name = os.environ["S3_BUCKET_NAME"]
@@ -57,3 +57,12 @@ class FanoutStack(Stack):
             s3.EventType.OBJECT_REMOVED,
             s3n.SnsDestination(topic)
         )
+        # lifecycle events move versions between storage classes or expire them
+        test_bucket.add_event_notification(
+            s3.EventType.LIFECYCLE_TRANSITION,
+            s3n.SnsDestination(topic)
+        )
+        test_bucket.add_event_notification(
+            s3.EventType.LIFECYCLE_EXPIRATION,
+            s3n.SnsDestination(topic)
+        )
@@ -1,15 +1,17 @@
 from aws_cdk import (
     Stack,
     aws_lambda as _lambda,
+    aws_dynamodb as dynamodb,
     aws_lambda_event_sources as lambda_event_sources,
     aws_sqs as sqs,
-    aws_iam as iam,
 )
 from constructs import Construct
 
 class LoggingStack(Stack):
     def __init__(self, scope: Construct, id: str,
                 logging_queue_arn: str,
+                dedup_table_arn: str,
+                size_index_table_arn: str,
                  **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
@@ -19,6 +21,20 @@ class LoggingStack(Stack):
             "LoggingQueue",
             logging_queue_arn
         )
+
+        # Import the event dedup table using its ARN
+        dedup_table = dynamodb.Table.from_table_arn(
+            self,
+            "DedupTable",
+            dedup_table_arn
+        )
+
+        # Import the object size index table using its ARN
+        size_index_table = dynamodb.Table.from_table_arn(
+            self,
+            "SizeIndexTable",
+            size_index_table_arn
+        )
         
         logging_lambda = _lambda.Function(
             self,
@@ -27,27 +43,21 @@ class LoggingStack(Stack):
             handler="logging_lambda.lambda_handler",
             code=_lambda.Code.from_asset("lambda"),
             environment={
-                "QUEUE_URL": logging_queue.queue_url
+                "QUEUE_URL": logging_queue.queue_url,
+                "DEDUP_TABLE_NAME": dedup_table.table_name,
+                "SIZE_INDEX_TABLE_NAME": size_index_table.table_name,
+                "EXECUTION_MODE": "async"  # log the records of a batch concurrently
             }
         )
 
         # grant permissions
         logging_queue.grant_consume_messages(logging_lambda)
+        dedup_table.grant_read_write_data(logging_lambda)
+        size_index_table.grant_read_write_data(logging_lambda)
 
         logging_lambda.add_event_source(
-            lambda_event_sources.SqsEventSource(logging_queue)
-        )
-
-        # grant permissions to read CloudWatch logs
-        logging_lambda.add_to_role_policy(
-            iam.PolicyStatement(
-                actions=[
-                    "logs:FilterLogEvents",  # Allows filtering log events
-                    "logs:GetLogEvents"     # Allows retrieving log events
-                ],
-                resources=["*"]
+            lambda_event_sources.SqsEventSource(
+                logging_queue,
+                report_batch_item_failures=True  # only retry the messages that failed
             )
-        )
-
-        # Expose the log group name
-        self.logging_lambda_log_group_name = logging_lambda.log_group.log_group_name
\ No newline at end of file
+        )
\ No newline at end of file
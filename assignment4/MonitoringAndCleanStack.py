@@ -4,7 +4,6 @@ from aws_cdk import (
     aws_s3 as s3,
     aws_iam as iam,
     aws_lambda as _lambda,
-    aws_logs as logs,
     aws_cloudwatch as cloudwatch,
     aws_cloudwatch_actions as cloudwatch_actions
 )
@@ -13,7 +12,6 @@ from constructs import Construct
 class MonitoringAndCleanStack(Stack):
     def __init__(self, scope: Construct, id: str,
                  test_bucket_arn: str,
-                 log_group_name: str,
                  **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
@@ -36,18 +34,9 @@ class MonitoringAndCleanStack(Stack):
         test_bucket.grant_read(cleaner_lambda)
         test_bucket.grant_delete(cleaner_lambda)
         
-        # Create a CloudWatch metric filter
-        logs.MetricFilter(
-            self,
-            "TotalObjectSizeMetricFilter",
-            log_group=logs.LogGroup.from_log_group_name(self, "LogGroup", log_group_name),
-            filter_pattern=logs.FilterPattern.exists("$.size_delta"),
-            metric_namespace="Assignment4App",
-            metric_name="TotalObjectSize",
-            metric_value="$.size_delta"
-        )
-
-        # Create a metric: SUM reflects the actual total bucket size instead of the delta per minute
+        # The logging lambda publishes TotalObjectSize as EMF metrics, one document per bucket and prefix
+        # of a batch; the dimensionless series is the total. SUM reflects the actual total bucket size
+        # instead of the delta per minute
         total_object_size_metric = cloudwatch.Metric(
             namespace="Assignment4App",
             metric_name="TotalObjectSize", 
@@ -11,20 +11,31 @@ from constructs import Construct
 class PlottingStack(Stack):
     def __init__(self, scope: Construct, construct_id: str,
                 table_arn: str,
+                history_shards: int,
+                state_table_arn: str,
+                totals_shards: int,
+                prefix_depth: int,
                 test_bucket_arn: str,
+                plot_backend: str = "native",
                 **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Import table and test bucket
         table = Dynamodb.Table.from_table_arn(self, "ImportedTable", table_arn)
+        state_table = Dynamodb.Table.from_table_arn(self, "ImportedStateTable", state_table_arn)
         bucket = s3.Bucket.from_bucket_arn(self, "ImportedTestBucket", test_bucket_arn)
         
-        # Pre-built Matplotlib Layer
-        matplotlib_layer = _lambda.LayerVersion.from_layer_version_arn(
-            self,
-            "MatplotlibLayer",
-            "arn:aws:lambda:us-west-1:770693421928:layer:Klayers-p310-matplotlib:4"
-        )
+        # The native renderer in lambda/plot_renderer.py needs no layer; the
+        # pre-built Matplotlib Layer is only added for the matplotlib backend
+        layers = []
+        memory_size = 256
+        if plot_backend == "matplotlib":
+            layers.append(_lambda.LayerVersion.from_layer_version_arn(
+                self,
+                "MatplotlibLayer",
+                "arn:aws:lambda:us-west-1:770693421928:layer:Klayers-p310-matplotlib:4"
+            ))
+            memory_size = 512
 
         # create plotting lambda
         plotting_lambda = _lambda.Function(
@@ -36,26 +47,39 @@ class PlottingStack(Stack):
             environment={
                 "TABLE_NAME": table.table_name,
                 "S3_BUCKET_NAME": bucket.bucket_name,
+                "HISTORY_SHARDS": str(history_shards),
+                "PLOT_BACKEND": plot_backend,
+                "STATE_TABLE_NAME": state_table.table_name,
+                "TOTALS_SHARDS": str(totals_shards),
+                "PREFIX_DEPTH": str(prefix_depth),
             },
             timeout=Duration.seconds(120),
-            memory_size=512,
-            layers=[matplotlib_layer],  # Add the Matplotlib layer
+            memory_size=memory_size,
+            layers=layers,
         )
 
         # grant permissions
         table.grant_read_data(plotting_lambda)
+        state_table.grant_read_data(plotting_lambda)  # running totals for /stats
+        bucket.grant_read(plotting_lambda)  # plot cache lookups and presigned URLs
         bucket.grant_write(plotting_lambda)
 
         # create Api gateway
         api = apigw.LambdaRestApi(
             self, "PlottingApi",
             handler=plotting_lambda,
+            # lets the lambda return the plot image itself as a base64 encoded body
+            binary_media_types=["*/*"],
         )
 
         # add a resource to the API
         plot_resource = api.root.add_resource("plot")
         plot_resource.add_method("GET")
 
+        # current totals of the bucket or of a key prefix, ?prefix=logs/
+        stats_resource = api.root.add_resource("stats")
+        stats_resource.add_method("GET")
+
         # expose api endpoint as an instance variable
         self.api_endpoint = api.url
         self.api_arn = f"arn:aws:execute-api:{self.region}:{self.account}:{api.rest_api_id}/*"
\ No newline at end of file
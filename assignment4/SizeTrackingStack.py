@@ -11,6 +11,11 @@ from constructs import Construct
 class SizeTrackingStack(Stack):
     def __init__(self, scope: Construct, id: str,
                  table_arn: str,
+                 history_shards: int,
+                 state_table_arn: str,
+                 totals_shards: int,
+                 prefix_depth: int,
+                 dedup_table_arn: str,
                  test_bucket_arn: str,
                  size_tracking_queue_arn: str,
                  **kwargs) -> None:
@@ -30,6 +35,20 @@ class SizeTrackingStack(Stack):
             table_arn
         )
 
+        # Import the object size state table using its ARN
+        state_table = dynamodb.Table.from_table_arn(
+            self,
+            "SizeStateTable",
+            state_table_arn
+        )
+
+        # Import the event dedup table using its ARN
+        dedup_table = dynamodb.Table.from_table_arn(
+            self,
+            "DedupTable",
+            dedup_table_arn
+        )
+
         # Get S3 bucket objects from ARN
         bucket = s3.Bucket.from_bucket_arn(
             self,
@@ -46,16 +65,33 @@ class SizeTrackingStack(Stack):
             code=_lambda.Code.from_asset("lambda"),
             environment={
                 "TABLE_NAME": table.table_name,
+                "STATE_TABLE_NAME": state_table.table_name,
+                "TRACKING_MODE": "incremental",
+                # apply independent keys concurrently, at most one per totals shard;
+                # with a single shard every key updates the same totals item
+                "EXECUTION_MODE": "async" if totals_shards > 1 else "sync",
+                "MAX_CONCURRENCY": str(totals_shards),
+                "HISTORY_SHARDS": str(history_shards),
+                "HISTORY_TTL_SECONDS": str(7 * 24 * 3600),  # raw rows are kept for a week
+                "TOTALS_SHARDS": str(totals_shards),
+                "PREFIX_DEPTH": str(prefix_depth),
+                "TRACK_STORAGE_CLASSES": "true",  # one HEAD request per created object
+                "DEDUP_TABLE_NAME": dedup_table.table_name,
                 "QUEUE_URL": size_tracking_queue.queue_url
             }
         )
 
         # grant permissions
-        table.grant_write_data(tracking_lambda)
+        table.grant_read_write_data(tracking_lambda)
+        state_table.grant_read_write_data(tracking_lambda)
+        dedup_table.grant_read_write_data(tracking_lambda)
         bucket.grant_read(tracking_lambda)
         size_tracking_queue.grant_consume_messages(tracking_lambda)
 
         # add SQS event source
         tracking_lambda.add_event_source(
-            lambda_event_sources.SqsEventSource(size_tracking_queue)
+            lambda_event_sources.SqsEventSource(
+                size_tracking_queue,
+                report_batch_item_failures=True  # only retry the messages that failed
+            )
         )
\ No newline at end of file
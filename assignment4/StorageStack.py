@@ -1,6 +1,7 @@
 # CDK stack include s3 buckets and DynamoDB table
 from aws_cdk import (
     Stack,
+    Duration,
     RemovalPolicy,
     aws_s3 as s3,
     aws_dynamodb as dynamodb,
@@ -16,7 +17,9 @@ class StorageStack(Stack):
             self,
             "TestBucket",
             removal_policy=RemovalPolicy.DESTROY,
-            auto_delete_objects=True
+            auto_delete_objects=True,
+            # plots are cached by content hash, the cache is rebuilt on demand
+            lifecycle_rules=[s3.LifecycleRule(prefix="plot/cache/", expiration=Duration.days(7))]
         )
 
         # Expose the bucket ARNs
@@ -30,12 +33,80 @@ class StorageStack(Stack):
                 name="bucket_name",
                 type=dynamodb.AttributeType.STRING
             ),
+            # epoch milliseconds followed by a random suffix, see lambda/size_history.py
             sort_key=dynamodb.Attribute(
                 name="timestamp",
-                type=dynamodb.AttributeType.STRING
+                type=dynamodb.AttributeType.NUMBER
             ),
+            # raw rows can expire, the minute/hour/day rollups keep the long range history
+            time_to_live_attribute="expires_at",
             removal_policy=RemovalPolicy.DESTROY
         )
 
         # Expose the table
         self.table_arn = table.table_arn
+
+        # Number of partitions the history rows of one bucket are spread over,
+        # raise it when a single bucket outgrows one partition's write throughput
+        self.history_shards = 1
+
+        # DynamoDB Table: last known size of every object plus running bucket totals,
+        # used by the size tracking lambda to apply per-event deltas
+        state_table = dynamodb.Table(
+            self,
+            "S3-object-size-state",
+            partition_key=dynamodb.Attribute(
+                name="bucket_name",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="object_key",
+                type=dynamodb.AttributeType.STRING
+            ),
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
+        # Expose the state table
+        self.state_table_arn = state_table.table_arn
+
+        # Layout of the running totals in the state table, shared by the size
+        # tracking lambda that writes them and the plotting lambda that reads them
+        # raise for buckets with thousands of object events per second; more
+        # than one shard also lets the tracking lambda apply keys concurrently
+        self.totals_shards = 1
+        self.prefix_depth = 2  # keep totals for the first two key segments
+
+        # DynamoDB Table: ids of S3 events each SQS consumer already processed,
+        # kept as long as the queues retain messages
+        dedup_table = dynamodb.Table(
+            self,
+            "S3-event-dedup",
+            partition_key=dynamodb.Attribute(
+                name="event_id",
+                type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
+        # Expose the dedup table
+        self.dedup_table_arn = dedup_table.table_arn
+
+        # DynamoDB Table: last known size and sequencer of every object, kept by
+        # the logging lambda so a delete can log the size of the removed object
+        size_index_table = dynamodb.Table(
+            self,
+            "S3-object-size-index",
+            partition_key=dynamodb.Attribute(
+                name="bucket_name",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="object_key",
+                type=dynamodb.AttributeType.STRING
+            ),
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
+        # Expose the size index table
+        self.size_index_table_arn = size_index_table.table_arn
@@ -16,6 +16,10 @@ storage_stack = StorageStack(app, "StorageStack", env=cdk.Environment(account=os
 
 plotting_stack = PlottingStack(app, "PlottingStack", 
                            table_arn=storage_stack.table_arn,
+                           history_shards=storage_stack.history_shards,
+                           state_table_arn=storage_stack.state_table_arn,
+                           totals_shards=storage_stack.totals_shards,
+                           prefix_depth=storage_stack.prefix_depth,
                            test_bucket_arn=storage_stack.test_bucket_arn,
                            env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')))
 
@@ -31,17 +35,23 @@ fanout_stack = FanoutStack(app, "FanoutStack",
 
 size_tracking_stack = SizeTrackingStack(app, "SizeTrackingStack",
                            table_arn=storage_stack.table_arn,
+                           history_shards=storage_stack.history_shards,
+                           state_table_arn=storage_stack.state_table_arn,
+                           totals_shards=storage_stack.totals_shards,
+                           prefix_depth=storage_stack.prefix_depth,
+                           dedup_table_arn=storage_stack.dedup_table_arn,
                            test_bucket_arn=storage_stack.test_bucket_arn,
                            size_tracking_queue_arn=fanout_stack.size_tracking_queue_arn,
                            env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')))
 
 logging_stack = LoggingStack(app, "LoggingStack",
                             logging_queue_arn=fanout_stack.logging_queue_arn,
+                            dedup_table_arn=storage_stack.dedup_table_arn,
+                            size_index_table_arn=storage_stack.size_index_table_arn,
                             env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')))
 
 monitoring_clean_stack = MonitoringAndCleanStack(app, "MonitoringAndCleanStack",
                                    test_bucket_arn=storage_stack.test_bucket_arn,
-                                   log_group_name=logging_stack.logging_lambda_log_group_name,
                                    env = cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')))
 
 app.synth()
\ No newline at end of file
@@ -0,0 +1,90 @@
+# boto3 clients created on first use from one tuned session per container
+import os
+import threading
+
+# The defaults give every client a 10 connection pool, legacy retries and no
+# keepalive, which serializes the parallel listing, shard reads and writes.
+# Each setting can be overridden from the environment of the lambda.
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '10'))
+TCP_KEEPALIVE = os.environ.get('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+
+# creating clients from a session is not thread safe
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_resources = {}
+
+
+def client_config(**overrides):
+    """
+    Return the botocore config shared by all clients, with optional
+    overrides for a single client.
+    """
+    from botocore.config import Config
+    config = Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries={'mode': RETRY_MODE, 'total_max_attempts': MAX_ATTEMPTS},
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        tcp_keepalive=TCP_KEEPALIVE
+    )
+    if overrides:
+        config = config.merge(Config(**overrides))
+    return config
+
+
+def session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                _session = boto3.session.Session()
+    return _session
+
+
+def client(service_name):
+    """
+    Return the shared client of a service. boto3 is only imported, and the
+    client only built, when a handler first needs it, which keeps it out of
+    the import time of the handler modules.
+    """
+    if service_name not in _clients:
+        shared_session = session()
+        with _lock:
+            if service_name not in _clients:
+                _clients[service_name] = shared_session.client(service_name, config=client_config())
+    return _clients[service_name]
+
+
+def resource(service_name):
+    """
+    Return the shared resource of a service, built like client().
+    """
+    if service_name not in _resources:
+        shared_session = session()
+        with _lock:
+            if service_name not in _resources:
+                _resources[service_name] = shared_session.resource(service_name, config=client_config())
+    return _resources[service_name]
+
+
+class LazyClient:
+    """
+    Stand-in for a module level client: attribute access is forwarded to the
+    shared client of the service, which is created on first use.
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(client(self.service_name), name)
+
+
+def lazy_client(service_name):
+    return LazyClient(service_name)
@@ -0,0 +1,108 @@
+# fully paginated S3 bucket listing, split by prefix and listed on a thread pool
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+def _paginate(s3_client, bucket_name, prefix, delimiter=None):
+    """
+    Follow continuation tokens until the whole prefix has been listed.
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    params = {'Bucket': bucket_name, 'Prefix': prefix}
+    if delimiter:
+        params['Delimiter'] = delimiter
+    return paginator.paginate(**params)
+
+
+def _discover_partitions(s3_client, bucket_name, prefix, delimiter, split_depth, partitions):
+    """
+    Walk the keyspace with the delimiter down to split_depth levels, collecting
+    the prefixes that should be listed in full into partitions. Objects found
+    directly at a level above the partitions are yielded as they are discovered.
+    """
+    current_level = [prefix]
+    for _ in range(split_depth):
+        next_level = []
+        for partition in current_level:
+            for page in _paginate(s3_client, bucket_name, partition, delimiter):
+                if page.get('Contents'):
+                    yield page['Contents']
+                next_level.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+        current_level = next_level
+        if not current_level:
+            break
+    partitions.extend(current_level)
+
+
+def list_object_pages(s3_client, bucket_name, prefix="", delimiter="/", max_workers=8, split_depth=1):
+    """
+    Yield every object of a bucket (under an optional prefix) as pages of
+    list_objects_v2 'Contents' entries.
+
+    The keyspace is split at the delimiter into up to split_depth levels of
+    prefixes, and each prefix is listed to the end on its own worker, so a full
+    scan scales with max_workers instead of being capped at one page of 1000 keys.
+    Pages are streamed as soon as a worker produces them; order is not preserved.
+    """
+    partitions = []
+    if max_workers <= 1 or split_depth <= 0:
+        partitions.append(prefix)
+    else:
+        yield from _discover_partitions(s3_client, bucket_name, prefix, delimiter, split_depth, partitions)
+
+    if not partitions:
+        return
+
+    pages = queue.Queue(maxsize=max_workers * 4)
+    stop = threading.Event()
+
+    def _put(item):
+        # give up once the consumer has stopped reading, instead of blocking forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _list_partition(partition):
+        if stop.is_set():
+            return
+        try:
+            for page in _paginate(s3_client, bucket_name, partition):
+                if page.get('Contents') and not _put(page['Contents']):
+                    return
+        except Exception as e:
+            _put(e)
+        finally:
+            if not stop.is_set():
+                _put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for partition in partitions:
+            executor.submit(_list_partition, partition)
+
+        try:
+            remaining = len(partitions)
+            while remaining:
+                item = pages.get()
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+
+def iter_objects(s3_client, bucket_name, prefix="", **kwargs):
+    """
+    Yield the individual objects of list_object_pages.
+    """
+    for page in list_object_pages(s3_client, bucket_name, prefix, **kwargs):
+        yield from page
@@ -1,13 +1,15 @@
-import boto3
-import logging
 import os
 
+import aws_clients
+import bucket_lister
+import key_filter
+import structured_log
+
 # Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = structured_log.get_logger('cleaner')
 
-# Initialize S3 client
-s3_client = boto3.client('s3')
+# S3 client, created on first use
+s3_client = aws_clients.lazy_client('s3')
 
 def lambda_handler(event, context):
     """
@@ -23,32 +25,29 @@ def lambda_handler(event, context):
         }
     
     try:
-        # list objs in the bucket
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' not in response:
+        # list all objs in the bucket, filtering out objects excluded by the key rules
+        filtered_objects = (
+            obj for obj in bucket_lister.iter_objects(s3_client, bucket_name)
+            if key_filter.is_included(obj['Key'])
+        )
+
+        # find the largest object
+        largest_object = max(filtered_objects, key=lambda obj: obj['Size'], default=None)
+        if largest_object is None:
             logger.info("Bucket is empty.")
             return {
                 "statusCode": 200,
                 "body": "No objects found in the bucket."
             }
-        
-        # Filter out objects with the "plot/" prefix
-        filtered_objects = [
-            obj for obj in response['Contents']
-            if not obj['Key'].startswith("plot/")
-        ]
-
-        
-        # find the largest object
-        largest_object = max(filtered_objects, key=lambda obj: obj['Size'])
+
         largest_object_key = largest_object['Key']
         largest_object_size = largest_object['Size']
 
-        logger.info(f"Largest object found: {largest_object_key}, Size: {largest_object_size} bytes")
+        logger.info("Largest object found: %s, Size: %d bytes", largest_object_key, largest_object_size)
 
         # delete the largest object
         s3_client.delete_object(Bucket=bucket_name, Key=largest_object_key)
-        logger.info(f"Deleted largest object: {largest_object_key}")
+        logger.info("Deleted largest object: %s", largest_object_key)
 
         return {
             "statusCode": 200,
@@ -56,7 +55,7 @@ def lambda_handler(event, context):
         }
     
     except Exception as e:
-        logger.error(f"Error deleting largest object: {str(e)}")
+        logger.error("Error deleting largest object: %s", e)
         return {
             "statusCode": 500,
             "body": f"Error deleting largest object: {str(e)}"
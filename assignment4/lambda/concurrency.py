@@ -0,0 +1,47 @@
+# sync or asyncio execution of independent per-record I/O in the handlers
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# "async" runs independent calls concurrently on an event loop, bounded by
+# MAX_CONCURRENCY; "sync" runs them one after another
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'sync')
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '16'))
+
+
+async def _gather(func, items, max_concurrency, executor):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(item):
+        async with semaphore:
+            # boto3 clients are thread safe, the blocking call runs in a pool
+            # as large as the semaphore; the loop's default pool only has
+            # min(32, cpus + 4) threads, 5 on a 1 vCPU lambda
+            try:
+                return await loop.run_in_executor(executor, func, item)
+            except Exception as e:
+                return e
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def _call(func, item):
+    try:
+        return func(item)
+    except Exception as e:
+        return e
+
+
+def run_all(func, items, max_concurrency=None, mode=None):
+    """
+    Call func on every item and return the results in the same order. An
+    exception raised by a call is returned in place of its result, so one
+    failing item does not hide the results of the others.
+    """
+    items = list(items)
+    if (mode or EXECUTION_MODE) == 'async' and len(items) > 1:
+        max_concurrency = max_concurrency or MAX_CONCURRENCY
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as executor:
+            return asyncio.run(_gather(func, items, max_concurrency, executor))
+    return [_call(func, item) for item in items]
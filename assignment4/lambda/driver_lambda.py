@@ -1,9 +1,14 @@
-import boto3
 import time
 import os
 import urllib.request 
 
-s3 = boto3.client('s3')
+import aws_clients
+import structured_log
+
+logger = structured_log.get_logger('driver')
+
+# S3 client, created on first use
+s3 = aws_clients.lazy_client('s3')
 bucket_name = os.environ["S3_BUCKET_NAME"]
 
 '''
@@ -20,7 +25,7 @@ def lambda_handler(event, context):
         Key="assignment1.txt",
         Body="Empty Assignment 1 "
     )
-    print("Created assignment1.txt with content 'Empty Assignment 1") #19 bytes
+    logger.info("Created assignment1.txt with content 'Empty Assignment 1") #19 bytes
 
     time.sleep(5)
 
@@ -30,7 +35,7 @@ def lambda_handler(event, context):
         Key="assignment2.txt",
         Body="Empty Assignment 2222222222 "
     )
-    print("Created assignment2.txt with content 'Empty Assignment 2222222222 '") #28 bytes
+    logger.info("Created assignment2.txt with content 'Empty Assignment 2222222222 '") #28 bytes
 
     time.sleep(70)
     
@@ -42,7 +47,7 @@ def lambda_handler(event, context):
         Key="assignment3.txt",
         Body="33"
     )
-    print("Created assignment3.txt with content '33'") #2 bytes
+    logger.info("Created assignment3.txt with content '33'") #2 bytes
 
     time.sleep(40)
     # (At this point, the alarm should fire and Cleaner should delete `assignment1.txt`
@@ -61,13 +66,13 @@ def lambda_handler(event, context):
         # Send the request and get the response
         with urllib.request.urlopen(req) as response:
             api_response = response.read().decode()
-            print(f"API Response: {api_response}")
+            logger.info("API Response: %s", api_response)
             return {
                 'statusCode': 200,
                 'body': api_response
             }
     except Exception as e:
-        print(f"Error calling the API: {e}")
+        logger.error("Error calling the API: %s", e)
         return {
             'statusCode': 500,
             'body': f"Error calling the API: {e}"
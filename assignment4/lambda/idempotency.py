@@ -0,0 +1,121 @@
+# deduplication of S3 events delivered more than once through the SNS -> SQS fan-out
+import time
+from collections import OrderedDict
+
+import aws_clients
+import batch_writer
+import structured_log
+
+logger = structured_log.get_logger('idempotency')
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+
+
+class EventInProgressError(Exception):
+    """
+    Raised when another invocation is processing the same event right now.
+    The message should be retried later rather than treated as done.
+    """
+
+
+def s3_event_id(consumer, bucket_name, object_key, sequencer):
+    """
+    Identify one S3 event for one consumer. The sequencer is unique per event
+    on a key, so bucket + key + sequencer tells redeliveries apart from new events.
+    """
+    return f"{consumer}:{bucket_name}/{object_key}@{sequencer}"
+
+
+class IdempotencyStore:
+    """
+    Remember which events a consumer already processed.
+
+    Completed event ids are kept in an in-memory LRU so redeliveries to a warm
+    container cost nothing, and in a dynamodb table (expiring through TTL) so
+    they are also caught across containers. An event is claimed with a
+    conditional write before it is processed, then either completed or
+    released. A claim left behind by a crashed invocation can be taken over
+    once in_progress_seconds have passed.
+    """
+
+    def __init__(self, table_name, dynamodb_client=None, ttl_seconds=4 * 24 * 3600,
+                 in_progress_seconds=60, cache_size=10000):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or aws_clients.lazy_client('dynamodb')
+        self.ttl_seconds = ttl_seconds
+        self.in_progress_seconds = in_progress_seconds
+        self.cache_size = cache_size
+        self.completed = OrderedDict()
+
+    def _remember(self, event_id):
+        self.completed[event_id] = True
+        self.completed.move_to_end(event_id)
+        if len(self.completed) > self.cache_size:
+            self.completed.popitem(last=False)
+
+    def claim(self, event_id):
+        """
+        Return True if the caller should process the event, False if it is a
+        duplicate that was already processed. Raises EventInProgressError if
+        another invocation holds a live claim on it.
+        """
+        if event_id in self.completed:
+            self.completed.move_to_end(event_id)
+            return False
+
+        now = int(time.time())
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'event_id': {'S': event_id},
+                    'status': {'S': IN_PROGRESS},
+                    'in_progress_until': {'N': str(now + self.in_progress_seconds)},
+                    'expires_at': {'N': str(now + self.ttl_seconds)}
+                },
+                ConditionExpression="attribute_not_exists(event_id) OR (#status = :in_progress AND in_progress_until < :now)",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={
+                    ":in_progress": {"S": IN_PROGRESS},
+                    ":now": {"N": str(now)}
+                },
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+            return True
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException as e:
+            status = e.response.get('Item', {}).get('status', {}).get('S')
+            if status == IN_PROGRESS:
+                raise EventInProgressError(f"Event is being processed by another invocation: {event_id}")
+
+            logger.info("Skipping duplicate event: %s", event_id, category="record")
+            self._remember(event_id)
+            return False
+
+    def complete(self, event_ids):
+        """
+        Mark claimed events as processed, in BatchWriteItem calls.
+        """
+        expires_at = str(int(time.time()) + self.ttl_seconds)
+        with batch_writer.BatchWriter(self.table_name, self.dynamodb_client) as writer:
+            for event_id in event_ids:
+                writer.put_item({
+                    'event_id': {'S': event_id},
+                    'status': {'S': COMPLETED},
+                    'expires_at': {'N': expires_at}
+                })
+                self._remember(event_id)
+
+    def release(self, event_ids):
+        """
+        Drop the claims of events that failed, so their redelivery is processed.
+        """
+        for event_id in event_ids:
+            self.completed.pop(event_id, None)
+            try:
+                self.dynamodb_client.delete_item(
+                    TableName=self.table_name,
+                    Key={'event_id': {'S': event_id}}
+                )
+            except Exception as e:
+                logger.warning("Error releasing claim of %s: %s", event_id, e)
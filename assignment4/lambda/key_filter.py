@@ -0,0 +1,63 @@
+# include/exclude rules for the object keys the handlers look at
+import fnmatch
+import json
+import os
+import re
+
+# The rules are a JSON object read from the KEY_RULES environment variable:
+#   {"exclude_prefixes": ["plot/"], "exclude_suffixes": [".tmp"],
+#    "exclude_globs": ["*/_temporary/*"], "include_prefixes": ["data/"]}
+# A key is skipped if it matches any exclude rule, or if include rules are
+# given and it matches none of them. Globs use fnmatch syntax, where '*' also
+# matches '/'.
+DEFAULT_RULES = {"exclude_prefixes": ["plot/"]}
+
+
+def _compile(prefixes, suffixes, globs):
+    """
+    Combine prefix, suffix and glob rules into a single regex, or None if
+    there are no rules. Prefixes share one alternation anchored at the start,
+    which the regex engine matches like a prefix trie.
+    """
+    alternatives = []
+    if prefixes:
+        alternatives.append("(?:" + "|".join(re.escape(prefix) for prefix in sorted(prefixes)) + ")")
+    if suffixes:
+        alternatives.append(".*(?:" + "|".join(re.escape(suffix) for suffix in sorted(suffixes)) + r")\Z")
+    for glob in globs:
+        alternatives.append(fnmatch.translate(glob))
+    if not alternatives:
+        return None
+    return re.compile("|".join(alternatives), re.DOTALL)
+
+
+class KeyFilter:
+    """
+    Compiled key rules. Call with an object key to know whether to process it.
+    """
+
+    def __init__(self, rules):
+        self.include = _compile(
+            rules.get("include_prefixes", []), rules.get("include_suffixes", []), rules.get("include_globs", [])
+        )
+        self.exclude = _compile(
+            rules.get("exclude_prefixes", []), rules.get("exclude_suffixes", []), rules.get("exclude_globs", [])
+        )
+
+    def __call__(self, key):
+        if self.include is not None and not self.include.match(key):
+            return False
+        return self.exclude is None or not self.exclude.match(key)
+
+
+def load_key_filter():
+    """
+    Compile the rules of the KEY_RULES environment variable, or the default
+    rules that skip the plot/ prefix.
+    """
+    rules = os.environ.get("KEY_RULES")
+    return KeyFilter(json.loads(rules) if rules else DEFAULT_RULES)
+
+
+# compiled once per container
+is_included = load_key_filter()
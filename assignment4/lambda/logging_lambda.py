@@ -1,91 +1,134 @@
-import json
-import logging
-import boto3
+import os
+
+import concurrency
+import idempotency
+import key_filter
+import metrics
+import s3_events
+import size_state
+import structured_log
 
 # Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = structured_log.get_logger('logging')
+
+# last known size of every object, so deletes know how much was removed
+SIZE_INDEX_TABLE_NAME = os.environ.get('SIZE_INDEX_TABLE_NAME')
 
-# Initialize CloudWatch Logs client
-logs_client = boto3.client('logs')
+# S3 events already logged by this consumer are skipped, the store lives as long as the container
+CONSUMER_NAME = "logging"
+DEDUP_TABLE_NAME = os.environ.get('DEDUP_TABLE_NAME')
+idempotency_store = idempotency.IdempotencyStore(DEDUP_TABLE_NAME) if DEDUP_TABLE_NAME else None
 
 def lambda_handler(event, context):
     """
     Lambda function to process S3 CreateObject and DeleteObject events from SQS messages.
-    Logs the event details into the Lambda's default CloudWatch log group.
+    Sums the size deltas of the batch per bucket and prefix and writes them to
+    the Lambda's default CloudWatch log group as EMF metrics.
+    Returns the SQS messages that failed so only those are retried.
     """
-
-    # Iterate through SQS messages
-    for record in event.get('Records', []):
+    failed_message_ids = []
+    logged_event_ids = []
+    size_deltas = {}
+
+    # Decode the SQS messages, their S3 event records are decoded as they are read
+    tasks = []
+    seen_event_ids = set()
+    for message_id, s3_records in s3_events.iter_messages(event):
         try:
-            # Parse the SQS message body
-            message_body = json.loads(record['body'])
-            print(f"Received SQS message: {message_body}")
-
-            # Parse the 'Message' field
-            sns_message = json.loads(message_body['Message'])
-
-            # Extract S3 event details
-            for s3_record in sns_message.get('Records', []):
-                event_name = s3_record.get('eventName')
-                object_key = s3_record.get('s3', {}).get('object', {}).get('key')
-
-                # Ignore objects with the "plot/" prefix, so plot will not trigger SQS event
-                if not object_key.startswith("plot/"):
-                    if event_name.startswith("ObjectCreated"):
-                        # Handle object creation
-                        object_size = s3_record.get('s3', {}).get('object', {}).get('size', 0)
-                        log_entry = {
-                            "object_name": object_key,
-                            "size_delta": object_size
-                        }
-                        print(f"Object created: {object_key}, Size: {object_size}")
-                        logger.info(json.dumps(log_entry))
-
-                    elif event_name.startswith("ObjectRemoved:Delete"):
-                        # Handle object deletion
-                        object_size = get_object_size_from_logs(object_key, context.log_group_name)
-                        log_entry = {
-                            "object_name": object_key,
-                            "size_delta": -object_size
-                        }
-                        print(f"Object deleted: {object_key}, Size: {object_size}")
-                        logger.info(json.dumps(log_entry))
+            for s3_record in s3_records:
+                # Ignore objects excluded by the key rules, so plot will not trigger SQS event
+                if not key_filter.is_included(s3_record.key):
+                    continue
+
+                # an event found twice in the batch is only logged once
+                event_id = get_event_id(s3_record)
+                if event_id in seen_event_ids:
+                    continue
+                if event_id:
+                    seen_event_ids.add(event_id)
+                tasks.append((message_id, s3_record, event_id))
 
         except Exception as e:
-            logger.error("Error processing SQS message: %s", str(e))
-            logger.exception(e)
+            logger.exception("Error processing SQS message %s: %s", message_id, e)
+            failed_message_ids.append(message_id)
+
+    # Size every record; in async mode the claims and size lookups run concurrently
+    results = concurrency.run_all(lambda task: process_s3_record(task[1], task[2]), tasks)
+    for (message_id, s3_record, event_id), result in zip(tasks, results):
+        if isinstance(result, Exception):
+            logger.error("Error processing SQS message %s: %s", message_id, result)
+            if message_id not in failed_message_ids:
+                failed_message_ids.append(message_id)
+        elif result is not None:
+            group = (s3_record.bucket, metrics.key_prefix(s3_record.key))
+            group_delta, group_events = size_deltas.get(group, (0, 0))
+            size_deltas[group] = (group_delta + result, group_events + 1)
+            if event_id:
+                logged_event_ids.append(event_id)
+
+    # One EMF line per bucket and prefix instead of one log line per object
+    emit_size_metrics(size_deltas)
+
+    # Remember the logged events, their redeliveries become no-ops
+    if idempotency_store:
+        idempotency_store.complete(logged_event_ids)
 
     return {
-        "statusCode": 200,
-        "body": "S3 events processed successfully"
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_message_ids]
     }
 
-def get_object_size_from_logs(object_key, log_group_name):
+def get_event_id(s3_record):
     """
-    Query CloudWatch Logs to find the size of the object from its creation log.
+    Return the id the event is deduplicated by, or None if it is not.
     """
-    try:
-        response = logs_client.filter_log_events(
-            logGroupName=log_group_name,
-            filterPattern=f'"{object_key}"',
-            limit=1
-        )
-        print(f"CloudWatch Logs response: {response}")
-
-        log_data = response['events'][0]['message']
-        print(f"Log data: {log_data}")
+    if idempotency_store and s3_record.sequencer:
+        return idempotency.s3_event_id(CONSUMER_NAME, s3_record.bucket, s3_record.key, s3_record.sequencer)
+    return None
 
-        start = log_data.find("'Message': '") + len("'Message': '")
-        end = log_data.find("}', 'Timestamp':")
-        message_json = log_data[start:end] + '}' 
+def process_s3_record(s3_record, event_id):
+    """
+    Return the size delta of one S3 event record, or None if it was already
+    counted.
+    """
+    # Skip events delivered more than once, so size_delta is only counted once
+    if event_id and not idempotency_store.claim(event_id):
+        return None
 
-        message_data = json.loads(message_json)
+    try:
+        return get_size_delta(s3_record)
+    except Exception:
+        if event_id:
+            idempotency_store.release([event_id])
+        raise
 
-        size = message_data['Records'][0]['s3']['object']['size']
+def emit_size_metrics(size_deltas):
+    """
+    Write the summed size deltas of a batch as TotalObjectSize metrics. Each
+    document is published without dimensions, per bucket and per bucket and
+    prefix, so the Sum of every dimension set adds up the same deltas.
+    """
+    for (bucket_name, prefix), (size_delta, events) in size_deltas.items():
+        metrics.emit(metrics.emf_document(
+            {"TotalObjectSize": (size_delta, "Bytes")},
+            {"BucketName": bucket_name, "Prefix": prefix},
+            [[], ["BucketName"], ["BucketName", "Prefix"]],
+            {"Events": events}
+        ))
+
+def get_size_delta(s3_record):
+    """
+    Return the size delta of one S3 event record. The size of every object is
+    kept in the size index table, so an overwrite counts the difference and a
+    delete the size of the removed object, with one read and one conditional write.
+    """
+    if s3_record.event_name.startswith("ObjectCreated"):
+        return size_state.record_object_size(
+            SIZE_INDEX_TABLE_NAME, s3_record.bucket, s3_record.key, s3_record.size, s3_record.sequencer
+        ).get('bucket_size', 0)
 
-        return size
+    if s3_record.event_name.startswith("ObjectRemoved:Delete"):
+        return size_state.forget_object_size(
+            SIZE_INDEX_TABLE_NAME, s3_record.bucket, s3_record.key, s3_record.sequencer
+        ).get('bucket_size', 0)
 
-    except:
-        logger.error("Error querying CloudWatch Logs")
-        return 0
\ No newline at end of file
+    return 0
@@ -0,0 +1,41 @@
+# CloudWatch Embedded Metric Format documents, written to the lambda log
+import json
+import time
+
+NAMESPACE = "Assignment4App"
+
+
+def key_prefix(object_key):
+    """
+    The first segment of an object key, used as the Prefix dimension.
+    Keys without a '/' are reported under '/'.
+    """
+    head, separator, _ = object_key.partition('/')
+    return head + separator if separator else '/'
+
+
+def emf_document(metrics, dimensions, dimension_sets, properties=None, namespace=NAMESPACE):
+    """
+    Build an EMF document. metrics maps a metric name to (value, unit),
+    dimensions maps a dimension name to its value, and dimension_sets lists
+    the combinations of dimensions the metrics are published under.
+    """
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": dimension_sets,
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()]
+            }]
+        }
+    }
+    document.update(dimensions)
+    document.update(properties or {})
+    document.update({name: value for name, (value, _) in metrics.items()})
+    return document
+
+
+def emit(document):
+    # the lambda log agent turns every EMF line on stdout into metric data
+    print(json.dumps(document, separators=(',', ':')))
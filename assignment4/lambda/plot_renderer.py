@@ -0,0 +1,315 @@
+# minimal time series line chart renderer, writes PNG and SVG without matplotlib
+import math
+import struct
+import zlib
+from datetime import datetime, timezone
+
+# NumPy speeds up the coordinate transforms of long series, but is not part of
+# the lambda runtime; the pure Python transforms give the same pixels
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLORS = {
+    "blue": (31, 119, 180),
+    "red": (214, 39, 40),
+    "black": (0, 0, 0),
+    "grid": (221, 221, 221),
+    "white": (255, 255, 255),
+}
+
+# 5x7 bitmap font, one hex digit pair per row; text is drawn in upper case
+FONT = {
+    "0": "0E11131519110E", "1": "040C040404040E", "2": "0E11010204081F", "3": "1F02040201110E",
+    "4": "02060A121F0202", "5": "1F101E0101110E", "6": "0608101E11110E", "7": "1F010204080808",
+    "8": "0E11110E11110E", "9": "0E11110F01020C", "A": "0E1111111F1111", "B": "1E11111E11111E",
+    "C": "0E11101010110E", "D": "1C12111111121C", "E": "1F10101E10101F", "F": "1F10101E101010",
+    "G": "0E11101711110F", "H": "1111111F111111", "I": "0E04040404040E", "J": "0702020202120C",
+    "K": "11121418141211", "L": "1010101010101F", "M": "111B1515111111", "N": "11111915131111",
+    "O": "0E11111111110E", "P": "1E11111E101010", "Q": "0E11111115120D", "R": "1E11111E141211",
+    "S": "0F10100E01011E", "T": "1F040404040404", "U": "1111111111110E", "V": "11111111110A04",
+    "W": "1111111515150A", "X": "11110A040A1111", "Y": "1111110A040404", "Z": "1F01020408101F",
+    " ": "00000000000000", ":": "000C0C000C0C00", "-": "0000001F000000", ".": "00000000000C0C",
+    "/": "00010204081000", "(": "02040808080402", ")": "08040202020408",
+}
+GLYPH_WIDTH, GLYPH_HEIGHT = 5, 7
+TEXT_SCALE = 2
+CHAR_ADVANCE = (GLYPH_WIDTH + 1) * TEXT_SCALE
+
+# seconds between time ticks, the first one giving at most MAX_TICKS ticks is used
+TIME_STEPS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400]
+MAX_TICKS = 8
+
+
+def _epoch_seconds(timestamp):
+    # naive datetimes are UTC, as the history timestamps are
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+def _scale(values, lo, hi, start, end):
+    """
+    Map values from [lo, hi] to pixel coordinates in [start, end].
+    """
+    factor = (end - start) / ((hi - lo) or 1)
+    if np is not None:
+        return (start + (np.asarray(values, dtype=float) - lo) * factor).round().astype(int).tolist()
+    return [round(start + (value - lo) * factor) for value in values]
+
+
+def _value_ticks(lo, hi):
+    # 1, 2 or 5 times a power of ten
+    raw_step = (hi - lo) / MAX_TICKS or 1
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+    first = -(-lo // step) * step
+    ticks = []
+    while first + len(ticks) * step <= hi:
+        ticks.append(first + len(ticks) * step)
+    return ticks
+
+
+def _time_ticks(lo, hi):
+    step = next((step for step in TIME_STEPS if (hi - lo) / step <= MAX_TICKS), TIME_STEPS[-1])
+    first = -(-lo // step) * step
+    return [first + i * step for i in range(int((hi - first) // step) + 1)]
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else f"{value:g}"
+
+
+def _format_time(seconds, span):
+    moment = datetime.fromtimestamp(seconds, timezone.utc)
+    return moment.strftime("%H:%M:%S" if span < 86400 else "%m-%d %H:%M")
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+class _Canvas:
+    """
+    RGB raster with the few drawing primitives a line chart needs.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(b"\xff" * (width * height * 3))
+
+    def point(self, x, y, color):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            offset = (y * self.width + x) * 3
+            self.pixels[offset:offset + 3] = bytes(color)
+
+    def hline(self, x0, x1, y, color, dash=None):
+        for x in range(min(x0, x1), max(x0, x1) + 1):
+            if dash is None or (x // dash) % 2 == 0:
+                self.point(x, y, color)
+
+    def vline(self, x, y0, y1, color):
+        for y in range(min(y0, y1), max(y0, y1) + 1):
+            self.point(x, y, color)
+
+    def line(self, x0, y0, x1, y1, color, width=2):
+        # Bresenham, thickened by drawing a small square per step
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        error = dx + dy
+        while True:
+            for ox in range(width):
+                for oy in range(width):
+                    self.point(x0 + ox, y0 + oy, color)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2 * error
+            if e2 >= dy:
+                error += dy
+                x0 += sx
+            if e2 <= dx:
+                error += dx
+                y0 += sy
+
+    def disc(self, cx, cy, radius, color):
+        for y in range(-radius, radius + 1):
+            for x in range(-radius, radius + 1):
+                if x * x + y * y <= radius * radius:
+                    self.point(cx + x, cy + y, color)
+
+    def text(self, x, y, text, color):
+        for char in text.upper():
+            rows = FONT.get(char, FONT[" "])
+            for row in range(GLYPH_HEIGHT):
+                bits = int(rows[row * 2:row * 2 + 2], 16)
+                for column in range(GLYPH_WIDTH):
+                    if bits & (1 << (GLYPH_WIDTH - 1 - column)):
+                        for oy in range(TEXT_SCALE):
+                            for ox in range(TEXT_SCALE):
+                                self.point(x + column * TEXT_SCALE + ox, y + row * TEXT_SCALE + oy, color)
+            x += CHAR_ADVANCE
+
+    def png(self):
+        row_size = self.width * 3
+        # filter type 0 before every row
+        raw = b"".join(
+            b"\x00" + bytes(self.pixels[y * row_size:(y + 1) * row_size]) for y in range(self.height)
+        )
+        header = struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+        return (
+            b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", header) +
+            _png_chunk(b"IDAT", zlib.compress(raw, 6)) + _png_chunk(b"IEND", b"")
+        )
+
+
+class LineChart:
+    """
+    A time series line chart with horizontal reference lines, drawn the way
+    the plotting lambda used matplotlib: a grid, tick labels, a title, axis
+    labels and a legend.
+    """
+    margin_left, margin_right, margin_top, margin_bottom = 110, 30, 50, 70
+
+    def __init__(self, title="", x_label="", y_label="", width=1000, height=500):
+        self.title = title
+        self.x_label = x_label
+        self.y_label = y_label
+        self.width = width
+        self.height = height
+        self.series = []
+        self.reference_lines = []
+        self.y_limits = None
+
+    def plot(self, times, values, color="blue", label=None, marker=True):
+        self.series.append(([_epoch_seconds(t) for t in times], list(values), color, label, marker))
+
+    def axhline(self, y, color="red", label=None, dashed=True):
+        self.reference_lines.append((y, color, label, dashed))
+
+    def ylim(self, lo, hi):
+        self.y_limits = (lo, hi)
+
+    def _layout(self):
+        times = [t for series in self.series for t in series[0]]
+        values = [v for series in self.series for v in series[1]] + [line[0] for line in self.reference_lines]
+        x_lo, x_hi = (min(times), max(times)) if times else (0, 1)
+        if x_lo == x_hi:
+            x_lo, x_hi = x_lo - 1, x_hi + 1
+        y_lo, y_hi = self.y_limits or ((min(values), max(values)) if values else (0, 1))
+        if y_lo == y_hi:
+            y_lo, y_hi = y_lo - 1, y_hi + 1
+
+        left, right = self.margin_left, self.width - self.margin_right
+        top, bottom = self.margin_top, self.height - self.margin_bottom
+        return {
+            "box": (left, top, right, bottom),
+            "x": lambda xs: _scale(xs, x_lo, x_hi, left, right),
+            "y": lambda ys: _scale(ys, y_lo, y_hi, bottom, top),
+            "x_ticks": [(t, _format_time(t, x_hi - x_lo)) for t in _time_ticks(x_lo, x_hi)],
+            "y_ticks": [(v, _format_value(v)) for v in _value_ticks(y_lo, y_hi)],
+        }
+
+    def _legend(self):
+        entries = [(label, color, False) for _, _, color, label, _ in self.series if label]
+        entries += [(label, color, dashed) for _, color, label, dashed in self.reference_lines if label]
+        return entries
+
+    def render_png(self):
+        layout = self._layout()
+        left, top, right, bottom = layout["box"]
+        canvas = _Canvas(self.width, self.height)
+        black, grid = COLORS["black"], COLORS["grid"]
+
+        # grid and tick labels
+        for (_, label), x in zip(layout["x_ticks"], layout["x"]([t for t, _ in layout["x_ticks"]])):
+            canvas.vline(x, top, bottom, grid)
+            canvas.vline(x, bottom, bottom + 5, black)
+            canvas.text(x - len(label) * CHAR_ADVANCE // 2, bottom + 10, label, black)
+        for (_, label), y in zip(layout["y_ticks"], layout["y"]([v for v, _ in layout["y_ticks"]])):
+            canvas.hline(left, right, y, grid)
+            canvas.hline(left - 5, left, y, black)
+            canvas.text(left - 10 - len(label) * CHAR_ADVANCE, y - GLYPH_HEIGHT, label, black)
+
+        # data
+        for y_value, color, _, dashed in self.reference_lines:
+            y = layout["y"]([y_value])[0]
+            for offset in (0, 1):
+                canvas.hline(left, right, y + offset, COLORS[color], dash=8 if dashed else None)
+        for times, values, color, _, marker in self.series:
+            points = list(zip(layout["x"](times), layout["y"](values)))
+            for (x0, y0), (x1, y1) in zip(points, points[1:]):
+                canvas.line(x0, y0, x1, y1, COLORS[color])
+            if marker:
+                for x, y in points:
+                    canvas.disc(x, y, 4, COLORS[color])
+
+        # frame, labels and legend
+        canvas.hline(left, right, top, black)
+        canvas.hline(left, right, bottom, black)
+        canvas.vline(left, top, bottom, black)
+        canvas.vline(right, top, bottom, black)
+        canvas.text((self.width - len(self.title) * CHAR_ADVANCE) // 2, 15, self.title, black)
+        canvas.text((left + right - len(self.x_label) * CHAR_ADVANCE) // 2, self.height - 25, self.x_label, black)
+        canvas.text(10, top - 20, self.y_label, black)
+        for i, (label, color, dashed) in enumerate(self._legend()):
+            y = top + 15 + i * 22
+            canvas.hline(right - 230, right - 200, y + GLYPH_HEIGHT, COLORS[color], dash=6 if dashed else None)
+            canvas.text(right - 190, y, label, black)
+
+        return canvas.png()
+
+    def render_svg(self):
+        layout = self._layout()
+        left, top, right, bottom = layout["box"]
+        elements = []
+
+        def text(x, y, content, anchor="middle", size=13, extra=""):
+            content = content.replace("&", "&amp;").replace("<", "&lt;")
+            elements.append(
+                f'<text x="{x}" y="{y}" text-anchor="{anchor}" font-family="sans-serif" font-size="{size}"{extra}>{content}</text>'
+            )
+
+        def rgb(color):
+            return "rgb({},{},{})".format(*COLORS[color])
+
+        for (_, label), x in zip(layout["x_ticks"], layout["x"]([t for t, _ in layout["x_ticks"]])):
+            elements.append(f'<line x1="{x}" y1="{top}" x2="{x}" y2="{bottom}" stroke="{rgb("grid")}"/>')
+            text(x, bottom + 20, label)
+        for (_, label), y in zip(layout["y_ticks"], layout["y"]([v for v, _ in layout["y_ticks"]])):
+            elements.append(f'<line x1="{left}" y1="{y}" x2="{right}" y2="{y}" stroke="{rgb("grid")}"/>')
+            text(left - 8, y + 4, label, anchor="end")
+
+        for y_value, color, _, dashed in self.reference_lines:
+            y = layout["y"]([y_value])[0]
+            dash = ' stroke-dasharray="8,8"' if dashed else ""
+            elements.append(f'<line x1="{left}" y1="{y}" x2="{right}" y2="{y}" stroke="{rgb(color)}" stroke-width="2"{dash}/>')
+        for times, values, color, _, marker in self.series:
+            points = list(zip(layout["x"](times), layout["y"](values)))
+            coordinates = " ".join(f"{x},{y}" for x, y in points)
+            elements.append(f'<polyline points="{coordinates}" fill="none" stroke="{rgb(color)}" stroke-width="2"/>')
+            if marker:
+                elements.extend(f'<circle cx="{x}" cy="{y}" r="4" fill="{rgb(color)}"/>' for x, y in points)
+
+        elements.append(
+            f'<rect x="{left}" y="{top}" width="{right - left}" height="{bottom - top}" fill="none" stroke="black"/>'
+        )
+        text(self.width // 2, 30, self.title, size=16)
+        text((left + right) // 2, self.height - 15, self.x_label)
+        text(25, (top + bottom) // 2, self.y_label, extra=f' transform="rotate(-90 25 {(top + bottom) // 2})"')
+        for i, (label, color, dashed) in enumerate(self._legend()):
+            y = top + 20 + i * 20
+            dash = ' stroke-dasharray="6,6"' if dashed else ""
+            elements.append(
+                f'<line x1="{right - 200}" y1="{y}" x2="{right - 170}" y2="{y}" stroke="{rgb(color)}" stroke-width="2"{dash}/>'
+            )
+            text(right - 160, y + 4, label, anchor="start")
+
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+            f'viewBox="0 0 {self.width} {self.height}">'
+            f'<rect width="100%" height="100%" fill="white"/>{"".join(elements)}</svg>'
+        )
@@ -1,109 +1,360 @@
 # Plotting lambda function trigger to query dynamodb table and generate plot
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import io
 import os
-import boto3
-import matplotlib.pyplot as plt
-import numpy as np
 import json
 
-dynamodb = boto3.client("dynamodb")
-s3 = boto3.client("s3")
+import aws_clients
+import concurrency
+import plot_renderer
+import size_history
+import size_state
+import structured_log
+
+logger = structured_log.get_logger('plotting')
+
+# clients are created on first use
+dynamodb = aws_clients.lazy_client("dynamodb")
+s3 = aws_clients.lazy_client("s3")
 
 table_name = os.environ['TABLE_NAME'] 
 bucket_name = os.environ["S3_BUCKET_NAME"]
-PLOT_FILE = "/tmp/size_history_plot.png"
+# "native" draws the plot with plot_renderer, "matplotlib" needs the matplotlib
+# layer of PlottingStack and is only imported when a plot is drawn
+PLOT_BACKEND = os.environ.get('PLOT_BACKEND', 'native')
+
+# output formats, chosen with the ?format= query parameter
+PLOT_CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+DEFAULT_PLOT_FORMAT = "png"
+
+# The plot is returned as a presigned URL in a JSON body, or as the image itself
+# when ?response=binary is given or the Accept header asks for an image
+PLOT_URL_EXPIRES_SECONDS = int(os.environ.get('PLOT_URL_EXPIRES_SECONDS', '3600'))
+
+# number of partitions the history rows of one bucket are spread over
+HISTORY_SHARDS = int(os.environ.get('HISTORY_SHARDS', '1'))
+
+# running totals of the size tracking lambda, served by /stats; see StorageStack
+STATE_TABLE_NAME = os.environ.get('STATE_TABLE_NAME')
+TOTALS_SHARDS = int(os.environ.get('TOTALS_SHARDS', '1'))
+PREFIX_DEPTH = int(os.environ.get('PREFIX_DEPTH', '0'))
+
+# plotted time window, can be changed with the ?window=<seconds> query parameter
+DEFAULT_WINDOW_SECONDS = 120
+
+# Plots are stored under the hash of the plotted data and render parameters, so
+# an unchanged series is neither rendered nor uploaded again. The hashes known
+# to exist in S3 are kept per container, least recently used first, with the
+# image when it is known; bump RENDER_VERSION when the look of the plot changes.
+PLOT_CACHE_PREFIX = "plot/cache/"
+PLOT_CACHE_SIZE = int(os.environ.get('PLOT_CACHE_SIZE', '64'))
+RENDER_VERSION = 1
+plot_cache = OrderedDict()
 
 def get_max_bucket_size(bucket_name):
+    # the summary item holds the max of every snapshot in a single read, once
+    # it was backfilled with the history from before it existed
+    summary = size_history.get_summary(dynamodb, table_name, bucket_name)
+    if summary and 'backfilled' in summary:
+        return int(summary['max_size']['N'])
+
+    # buckets without a backfilled summary yet fall back to the day rollups
     max_size = 0
-    last_evaluated_key = None
-
-    while True:
-        if last_evaluated_key:
-            response = dynamodb.query(
-                TableName=table_name,
-                KeyConditionExpression="bucket_name = :bucket_name",
-                ExpressionAttributeValues={
-                    ":bucket_name": {"S": bucket_name}
-                },
-                ExclusiveStartKey=last_evaluated_key
-            )
-        else:
-            response = dynamodb.query(
-                TableName=table_name,
-                KeyConditionExpression="bucket_name = :bucket_name",
-                ExpressionAttributeValues={
-                    ":bucket_name": {"S": bucket_name}
-                }
-            )
-            
-            for item in response['Items']:
-                size = int(item['bucket_size']['N'])
-                if size > max_size:
-                    max_size = size
-
-            last_evaluated_key = response.get('LastEvaluatedKey')
-            if not last_evaluated_key:
-                break
+    for item in size_history.query_rollups(dynamodb, table_name, bucket_name, 'day', 0):
+        size = int(item['max_size']['N'])
+        if size > max_size:
+            max_size = size
 
     return max_size
 
+def get_window_seconds(event):
+    query_parameters = (event or {}).get("queryStringParameters") or {}
+    try:
+        return max(1, int(query_parameters.get("window", DEFAULT_WINDOW_SECONDS)))
+    except ValueError:
+        return DEFAULT_WINDOW_SECONDS
+
+def get_plot_format(event):
+    query_parameters = (event or {}).get("queryStringParameters") or {}
+    plot_format = str(query_parameters.get("format", DEFAULT_PLOT_FORMAT)).lower()
+    return plot_format if plot_format in PLOT_CONTENT_TYPES else DEFAULT_PLOT_FORMAT
+
+def query_size_items(threshold_ms, window_seconds):
+    """
+    Return (item, bucket size attribute) pairs for the window, oldest first.
+    Short windows read raw rows, longer ones the matching rollups.
+    """
+    resolution = size_history.pick_resolution(window_seconds * 1000)
+    logger.info("Reading %s rows for a %ds window", resolution or "raw", window_seconds)
+
+    if resolution is None:
+        items = size_history.query_history(dynamodb, table_name, bucket_name, threshold_ms, shards=HISTORY_SHARDS)
+        return [(item, 'bucket_size') for item in items]
+
+    items = size_history.query_rollups(dynamodb, table_name, bucket_name, resolution, threshold_ms)
+    return [(item, 'last_size') for item in items]
+
     
+def get_stats(event):
+    """
+    Return the current size and number of objects of the bucket, or of the key
+    prefix given with ?prefix=, with the totals of its child prefixes. Only
+    the prefixes of the first PREFIX_DEPTH key segments are tracked.
+    """
+    query_parameters = (event or {}).get("queryStringParameters") or {}
+    prefix = query_parameters.get("prefix") or ""
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+
+    # the prefix totals and the child prefixes are independent reads
+    reads = [
+        lambda: size_state.get_prefix_totals(STATE_TABLE_NAME, bucket_name, prefix, PREFIX_DEPTH, TOTALS_SHARDS),
+        lambda: size_state.list_child_prefixes(STATE_TABLE_NAME, bucket_name, prefix, TOTALS_SHARDS)
+    ]
+    if not prefix:
+        reads.append(lambda: size_state.read_totals_breakdown(STATE_TABLE_NAME, bucket_name, TOTALS_SHARDS))
+    results = concurrency.run_all(lambda read: read(), reads, mode='async')
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    totals, children = results[0], results[1]
+    if totals is None:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({
+                "status": "Error",
+                "message": f"Prefix {prefix} is not tracked, only the first {PREFIX_DEPTH} key segments are"
+            })
+        }
+
+    stats = {
+        "bucket": bucket_name,
+        "prefix": prefix,
+        "bucket_size": totals[0],
+        "number_of_objects": totals[1],
+        "children": {
+            child: {"bucket_size": size, "number_of_objects": objects}
+            for child, (size, objects) in sorted(children.items())
+        }
+    }
+    if not prefix:
+        # noncurrent versions, delete markers and the size_<storage class> totals
+        stats["totals"] = results[2]
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(stats)
+    }
+
 def lambda_handler(event, context):
+    # the API routes /stats and /plot to this function
+    if (event or {}).get("resource") == "/stats":
+        return get_stats(event)
+
     current_time = datetime.utcnow() # Get current time in UTC
-    print("event query at: ", current_time)
-
-    # query items in table for last 120 second
-    threshold_time = current_time - timedelta(seconds=120)
-    threshold_time_str = threshold_time.strftime("%Y-%m-%d %H:%M:%S")
-    print("threshold time: ", threshold_time)
-
-    # Retrieve the bucket size from the DynamoDB table
-    response = dynamodb.query(
-        TableName=table_name,
-        KeyConditionExpression="bucket_name = :bucket_name AND #ts >= :threshold_time",
-        ExpressionAttributeValues={
-            ":bucket_name": {"S": bucket_name},
-            ":threshold_time": {"S": threshold_time_str}
-        },
-        ExpressionAttributeNames={"#ts": "timestamp"},   # map timestamp to #ts
-        ScanIndexForward=True  # ascending (oldest to newest)
-    )
-
-    print("response: ", response)
-    print("response length: ", len(response['Items']))
+    logger.debug("event query at: %s", current_time)
+
+    # query items in table for the requested window, 120 seconds by default
+    window_seconds = get_window_seconds(event)
+    threshold_time = current_time - timedelta(seconds=window_seconds)
+    logger.debug("threshold time: %s", threshold_time)
+
+    # Retrieve the bucket size from the DynamoDB table, oldest to newest, and
+    # the maximum bucket size in history; both reads run concurrently
+    threshold_ms = int(threshold_time.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    reads = [
+        lambda: query_size_items(threshold_ms, window_seconds),
+        lambda: get_max_bucket_size(bucket_name)
+    ]
+    items, max_bucket_size = concurrency.run_all(lambda read: read(), reads, mode='async')
+    for result in (items, max_bucket_size):
+        if isinstance(result, Exception):
+            raise result
+
+    # the items themselves are only written at DEBUG, they are the largest part of the log
+    logger.info("Read %d items", len(items))
+    logger.debug("items", items=lambda: [item for item, _ in items])
 
     size_data = []
     timestamps = []
 
-    for item in response['Items']:
+    for item, size_attribute in items:
         # Extract bucket size and timestamp from each item
-        print("item: ", item)
-        
-        sizeData = item['bucket_size']['N']
-        timestamp = item['timestamp']['S']
-
-        print("ADD item bucket_size: ", sizeData)
-        print("ADD item timestamp: ", timestamp)
+        sizeData = item[size_attribute]['N']
+        timestamp = datetime.utcfromtimestamp(size_history.sort_key_to_epoch_ms(item['timestamp']['N']) / 1000)
 
         size_data.append(int(sizeData))                 #convert str to int
-        timestamps.append(timestamp.split('.')[0])      # remove milliseconds
+        timestamps.append(timestamp.replace(microsecond=0))      # remove milliseconds
 
-    print("ENDED size_data: ", size_data)
-    print("ENDED timestamps: ", timestamps)
+    logger.debug("size data", size_data=size_data, timestamps=timestamps)
 
     if len(size_data) == 0:
-        print("No data found for the last 120 seconds.")
+        logger.info("No data found for the last %d seconds.", window_seconds)
         return {"status": "No size_data produced"}
     
-    # Get the maximum bucket size in history
-    max_bucket_size = get_max_bucket_size(bucket_name)
-    print(f"Maximum bucket size in history: {max_bucket_size}")
+    logger.info("Maximum bucket size in history: %d", max_bucket_size)
+
+    # An unchanged series is served from the plot cache
+    plot_format = get_plot_format(event)
+    plot_hash = get_plot_hash(timestamps, size_data, max_bucket_size, window_seconds, plot_format)
+    plot_key = f"{PLOT_CACHE_PREFIX}{plot_hash}.{plot_format}"
+    content_type = PLOT_CONTENT_TYPES[plot_format]
+    binary = get_response_mode(event, content_type) == "binary"
+
+    # Only the image itself is validated by its hash: a JSON body carries a
+    # presigned URL that expires, and the Accept header picks between the two
+    headers = {"Vary": "Accept"}
+    if binary:
+        headers["ETag"] = f'"{plot_hash}"'
+        if headers["ETag"] in get_if_none_match(event):
+            logger.info("Plot %s not modified", plot_hash)
+            return {"statusCode": 304, "headers": headers}
+
+    cache_status = "hit"
+    found, plot = get_cached_plot(plot_hash, plot_key, with_body=binary)
+    if not found:
+        cache_status = "miss"
+        plot = render_plot(timestamps, size_data, max_bucket_size, window_seconds, plot_format)
+
+        # Upload the plot to S3 straight from memory
+        try:
+            s3.put_object(Bucket=bucket_name, Key=plot_key, Body=plot, ContentType=content_type)
+            logger.info("Plot uploaded to S3://%s/%s", bucket_name, plot_key)
+
+        except Exception as e:
+            logger.error("Error uploading plot to S3: %s", e)
+            return {
+                "status": "Error",
+                "message": f"Failed to upload plot to S3: {e}"
+            }
+        remember_plot(plot_hash, plot)
+
+    headers["X-Plot-Cache"] = cache_status
+    if binary:
+        # API Gateway decodes the body, see binary_media_types in PlottingStack
+        return {
+            "statusCode": 200,
+            "headers": dict(headers, **{"Content-Type": content_type}),
+            "isBase64Encoded": True,
+            "body": base64.b64encode(plot).decode()
+        }
+
+    # Return success response 
+    return {
+        "statusCode": 200,
+        "headers": dict(headers, **{"Content-Type": "application/json"}),
+        "body": json.dumps({
+            "status": "Success",
+            "s3_path": f"s3://{bucket_name}/{plot_key}",
+            "url": s3.generate_presigned_url(
+                "get_object", Params={"Bucket": bucket_name, "Key": plot_key}, ExpiresIn=PLOT_URL_EXPIRES_SECONDS
+            ),
+            "max_bucket_size": max_bucket_size
+        })
+    }
+
+def get_plot_hash(timestamps, size_data, max_bucket_size, window_seconds, plot_format):
+    """
+    Return the hash of everything the plot is drawn from.
+    """
+    plotted = {
+        "version": RENDER_VERSION,
+        "backend": PLOT_BACKEND,
+        "format": plot_format,
+        "window": window_seconds,
+        "timestamps": [timestamp.isoformat() for timestamp in timestamps],
+        "size_data": size_data,
+        "max_bucket_size": max_bucket_size
+    }
+    return hashlib.sha256(json.dumps(plotted, separators=(',', ':')).encode()).hexdigest()
+
+def get_header(event, header_name):
+    # API Gateway keeps the header case of the client
+    headers = (event or {}).get("headers") or {}
+    for name, value in headers.items():
+        if name.lower() == header_name:
+            return value or ""
+    return ""
+
+def get_if_none_match(event):
+    return [tag.strip() for tag in get_header(event, "if-none-match").split(",") if tag.strip()]
+
+def get_response_mode(event, content_type):
+    """
+    Return "binary" to answer with the image itself, "url" for a JSON body
+    with a presigned URL.
+    """
+    query_parameters = (event or {}).get("queryStringParameters") or {}
+    response_mode = str(query_parameters.get("response", "")).lower()
+    if response_mode in ("binary", "url"):
+        return response_mode
+
+    accept = get_header(event, "accept")
+    if content_type in accept or "image/*" in accept:
+        return "binary"
+    return "url"
+
+def get_cached_plot(plot_hash, plot_key, with_body=False):
+    """
+    Return (True, image) if the plot of this hash is already in S3, checking
+    the container's cache before asking S3. The image is None when it was not
+    asked for and is not in the container's cache.
+    """
+    plot = plot_cache.get(plot_hash)
+    if plot_hash in plot_cache and (plot is not None or not with_body):
+        plot_cache.move_to_end(plot_hash)
+        return True, plot
+
+    try:
+        if with_body:
+            plot = s3.get_object(Bucket=bucket_name, Key=plot_key)["Body"].read()
+        else:
+            s3.head_object(Bucket=bucket_name, Key=plot_key)
+    except Exception:
+        # a missing object, or any other error, only costs a render
+        return False, None
+    remember_plot(plot_hash, plot)
+    return True, plot
+
+def remember_plot(plot_hash, plot=None):
+    plot_cache[plot_hash] = plot
+    plot_cache.move_to_end(plot_hash)
+    while len(plot_cache) > PLOT_CACHE_SIZE:
+        plot_cache.popitem(last=False)
+
+def render_plot(timestamps, size_data, max_bucket_size, window_seconds, plot_format):
+    """
+    Draw the plot with the configured backend and return the image bytes.
+    """
+    title = f"S3 Bucket Size History (Last {window_seconds}s)"
 
-    # Generate and store the plot
-    timestamp_objects = [datetime.strptime(ts, "%Y-%m-%d %H:%M:%S") for ts in timestamps]
+    if PLOT_BACKEND == "matplotlib":
+        plot = render_plot_with_matplotlib(plot_format, title, timestamps, size_data, max_bucket_size)
+    else:
+        chart = plot_renderer.LineChart(title, "Timestamp", "Bucket Size")
+        chart.plot(timestamps, size_data, color="blue", label="Bucket Size")
+        # Add a horizontal line for the maximum bucket size
+        chart.axhline(max_bucket_size, color="red", label="Max Bucket Size")
+        chart.ylim(min(size_data) - 1, max_bucket_size + 20)
+
+        plot = chart.render_svg().encode() if plot_format == "svg" else chart.render_png()
+
+    logger.debug("Plot rendered", bytes=len(plot), format=plot_format)
+    return plot
+
+def render_plot_with_matplotlib(plot_format, title, timestamps, size_data, max_bucket_size):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
 
     plt.figure(figsize=(10, 5))
-    plt.plot(timestamp_objects, size_data, marker="o", linestyle="-", color="b", label="Bucket Size")
+    plt.plot(timestamps, size_data, marker="o", linestyle="-", color="b", label="Bucket Size")
     
     # Add a horizontal line for the maximum bucket size
     plt.axhline(y=max_bucket_size, color="r", linestyle="--", label="Max Bucket Size")
@@ -114,38 +365,12 @@ def lambda_handler(event, context):
 
     plt.xlabel("Timestamp")
     plt.ylabel("Bucket Size")
-    plt.title("S3 Bucket Size History (Last 120s)")
+    plt.title(title)
     plt.legend()
     plt.grid()
     plt.xticks(rotation=45)
 
-    # Debug
-    print("Plot data - Timestamps:", timestamps)
-    print("Plot data - Size data:", size_data)
-
-    plt.savefig(PLOT_FILE)  # Save locally in Lambda's temp storage
-    print(f"Plot saved locally at {PLOT_FILE}")
-
-    # Upload the plot to S3
-    plot_key = "plot/size_history_plot.png"
-    try:
-        s3.upload_file(PLOT_FILE, bucket_name, plot_key)
-        print(f"Plot uploaded to S3://{bucket_name}/{plot_key}")
-
-    except Exception as e:
-        print(f"Error uploading plot to S3: {e}")
-        return {
-            "status": "Error",
-            "message": f"Failed to upload plot to S3: {e}"
-        } 
-
-    # Return success response 
-    return {
-        "statusCode": 200,
-        "headers": {"Content-Type": "application/json"},
-        "body": json.dumps({
-            "status": "Success",
-            "s3_path": f"s3://{bucket_name}/{plot_key}",
-            "max_bucket_size": max_bucket_size
-        })
-    }
\ No newline at end of file
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format=plot_format)
+    plt.close()
+    return buffer.getvalue()
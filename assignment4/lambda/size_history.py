@@ -0,0 +1,384 @@
+# key schema, rollups and sharded reads of the S3-object-size-history table
+import heapq
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import concurrency
+import structured_log
+
+logger = structured_log.get_logger('size_history')
+
+# The sort key is the epoch time in milliseconds followed by a 6 digit random
+# suffix, so two snapshots of the same bucket in the same millisecond do not
+# overwrite each other and the key still sorts numerically by time.
+SUFFIX_DIGITS = 6
+SUFFIX_RANGE = 10 ** SUFFIX_DIGITS
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def make_sort_key(epoch_ms):
+    return epoch_ms * SUFFIX_RANGE + random.randrange(SUFFIX_RANGE)
+
+
+def sort_key_to_epoch_ms(sort_key):
+    return int(sort_key) // SUFFIX_RANGE
+
+
+def partition_key(bucket_name, shard, shards):
+    """
+    With more than one shard the rows of a bucket are spread over
+    '<bucket>#<shard>' partitions. S3 bucket names cannot contain '#'.
+    """
+    if shards <= 1:
+        return bucket_name
+    return f"{bucket_name}#{shard}"
+
+
+def bucket_from_partition_key(key):
+    return key.split('#', 1)[0]
+
+
+def make_history_item(bucket_name, epoch_ms, bucket_size, number_of_objects, shards=1, ttl_seconds=None):
+    """
+    Build a size history row. The write shard is derived from the random
+    suffix of the sort key, so concurrent writers spread evenly over the shards.
+    With ttl_seconds the row expires, its history is kept by the rollups.
+    """
+    sort_key = make_sort_key(epoch_ms)
+    item = {
+        'bucket_name': {'S': partition_key(bucket_name, sort_key % shards, shards)},
+        'timestamp': {'N': str(sort_key)},
+        'bucket_size': {'N': str(bucket_size)},
+        'number_of_objects': {'N': str(number_of_objects)}
+    }
+    if ttl_seconds:
+        item['expires_at'] = {'N': str(epoch_ms // 1000 + ttl_seconds)}
+    return item
+
+
+# Rollups keep min/max/last/count of the snapshots of a bucket per period in
+# '<bucket>#rollup#<resolution>' partitions, keyed by the period start.
+ROLLUP_RESOLUTIONS = {
+    'minute': 60 * 1000,
+    'hour': 60 * 60 * 1000,
+    'day': 24 * 60 * 60 * 1000
+}
+
+
+def rollup_partition_key(bucket_name, resolution):
+    return f"{bucket_name}#rollup#{resolution}"
+
+
+# The summary item holds the same aggregates over all snapshots of a bucket,
+# backfilled from the day rollups when it is created (or was created before
+# the backfill existed, which its missing 'backfilled' attribute tells),
+# so the current and all-time min/max sizes are a single read.
+SUMMARY_PARTITION_SUFFIX = "#summary"
+SUMMARY_SORT_KEY = 0
+
+
+def summary_key(bucket_name):
+    return {
+        'bucket_name': {'S': bucket_name + SUMMARY_PARTITION_SUFFIX},
+        'timestamp': {'N': str(SUMMARY_SORT_KEY)}
+    }
+
+
+def pick_resolution(window_ms):
+    """
+    Choose the coarsest data that still gives a few hundred points for a
+    window: raw rows up to an hour, then minute, hour and day rollups.
+    """
+    if window_ms <= ROLLUP_RESOLUTIONS['hour']:
+        return None
+    if window_ms <= 8 * ROLLUP_RESOLUTIONS['hour']:
+        return 'minute'
+    if window_ms <= 20 * ROLLUP_RESOLUTIONS['day']:
+        return 'hour'
+    return 'day'
+
+
+# Min and max commute, so every snapshot is folded into them whatever order
+# it arrives in, e.g. from a replay of the history; last follows the snapshot
+# with the newest timestamp. The sample count is added in one transaction with
+# a mark on the history row, so a row folded in twice is counted once.
+AGGREGATE_ATTEMPTS = 5
+RETRYABLE_CANCELLATION_CODES = {'None', 'TransactionConflict'}
+
+
+def _update_aggregate(dynamodb_client, table_name, key, epoch_ms, bucket_size, number_of_objects):
+    """
+    Fold the min, max and last of one snapshot into a rollup or summary item.
+    The newest snapshot between the current min and max takes one conditional
+    update, any other one more update per aggregate it changes. Returns the
+    item as it was before, {} if the snapshot created it.
+    """
+    values = {
+        ':size': {'N': str(bucket_size)},
+        ':objects': {'N': str(number_of_objects)},
+        ':ts': {'N': str(epoch_ms)}
+    }
+    set_last = "last_size = :size, last_number_of_objects = :objects, last_timestamp = :ts"
+    try:
+        response = dynamodb_client.update_item(
+            TableName=table_name,
+            Key=key,
+            UpdateExpression="SET " + set_last + (
+                ", min_size = if_not_exists(min_size, :size), max_size = if_not_exists(max_size, :size)"
+            ),
+            ConditionExpression=(
+                "attribute_not_exists(last_timestamp) OR "
+                "(last_timestamp < :ts AND min_size <= :size AND max_size >= :size)"
+            ),
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_OLD',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        return response.get('Attributes', {})
+    except dynamodb_client.exceptions.ConditionalCheckFailedException as e:
+        current = e.response['Item']
+
+    # each update only moves its aggregate further, so concurrent writers converge
+    updates = []
+    if int(current['last_timestamp']['N']) < epoch_ms:
+        updates.append(("SET " + set_last, "last_timestamp < :ts", values))
+    if bucket_size < int(current['min_size']['N']):
+        updates.append(("SET min_size = :size", "min_size > :size", {':size': values[':size']}))
+    if bucket_size > int(current['max_size']['N']):
+        updates.append(("SET max_size = :size", "max_size < :size", {':size': values[':size']}))
+    for update_expression, condition, update_values in updates:
+        try:
+            dynamodb_client.update_item(
+                TableName=table_name,
+                Key=key,
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=update_values
+            )
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            pass  # another snapshot moved it further in the meantime
+    return current
+
+
+def _count_sample(dynamodb_client, table_name, row, keys):
+    """
+    Add a history row to the sample count of its aggregates and mark the row
+    as counted, all or none. Returns False if the row was counted before.
+    """
+    row_key = {'bucket_name': row['bucket_name'], 'timestamp': row['timestamp']}
+    items = [{'Update': {
+        'TableName': table_name,
+        'Key': row_key,
+        'UpdateExpression': "SET rolled_up = :true",
+        'ConditionExpression': "attribute_exists(bucket_name) AND attribute_not_exists(rolled_up)",
+        'ExpressionAttributeValues': {':true': {'BOOL': True}}
+    }}]
+    for key in keys:
+        items.append({'Update': {
+            'TableName': table_name,
+            'Key': key,
+            'UpdateExpression': "ADD sample_count :one",
+            'ExpressionAttributeValues': {':one': {'N': '1'}}
+        }})
+
+    for attempt in range(AGGREGATE_ATTEMPTS):
+        try:
+            dynamodb_client.transact_write_items(TransactItems=items)
+            return True
+        except dynamodb_client.exceptions.TransactionCanceledException as e:
+            codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if codes and codes[0] == 'ConditionalCheckFailed':
+                return False
+            if not all(code in RETRYABLE_CANCELLATION_CODES for code in codes):
+                raise
+        time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+    raise RuntimeError(f"Aggregates of {row_key['bucket_name']['S']} conflicted during {AGGREGATE_ATTEMPTS} attempts to count a sample")
+
+
+def _rollup_key(bucket_name, resolution, epoch_ms):
+    period_ms = ROLLUP_RESOLUTIONS[resolution]
+    return {
+        'bucket_name': {'S': rollup_partition_key(bucket_name, resolution)},
+        'timestamp': {'N': str(epoch_ms // period_ms * period_ms * SUFFIX_RANGE)}
+    }
+
+
+def update_rollups(dynamodb_client, table_name, row):
+    """
+    Fold one history row into the minute, hour and day rollups of its bucket,
+    concurrently, and then into its summary. Call it once the row is written,
+    so every sample of an aggregate has a row; folding the same row in again
+    changes nothing.
+    """
+    bucket_name = bucket_from_partition_key(row['bucket_name']['S'])
+    epoch_ms = sort_key_to_epoch_ms(row['timestamp']['N'])
+    bucket_size, number_of_objects = int(row['bucket_size']['N']), int(row['number_of_objects']['N'])
+
+    def update(key):
+        return _update_aggregate(dynamodb_client, table_name, key, epoch_ms, bucket_size, number_of_objects)
+
+    keys = [_rollup_key(bucket_name, resolution, epoch_ms) for resolution in ROLLUP_RESOLUTIONS]
+    _count_sample(dynamodb_client, table_name, row, keys + [summary_key(bucket_name)])
+    for result in concurrency.run_all(update, keys):
+        if isinstance(result, Exception):
+            raise result
+
+    # the day rollups hold this snapshot by now, which the backfill relies on
+    if 'backfilled' not in update(summary_key(bucket_name)):
+        backfill_summary(dynamodb_client, table_name, bucket_name)
+
+
+def backfill_summary(dynamodb_client, table_name, bucket_name):
+    """
+    Widen the summary of a bucket to the min, max and sample count of all its
+    day rollups, for buckets whose history is older than their summary.
+    Returns False if another snapshot changed the summary meanwhile; the
+    backfill is then tried again with the next snapshot.
+    """
+    summary = dynamodb_client.get_item(
+        TableName=table_name, Key=summary_key(bucket_name), ConsistentRead=True
+    ).get('Item')
+    if not summary:
+        return False
+
+    min_size, max_size = int(summary['min_size']['N']), int(summary['max_size']['N'])
+    old_count = summary.get('sample_count', {'N': '0'})
+    sample_count = 0
+    for item in query_rollups(dynamodb_client, table_name, bucket_name, 'day', 0):
+        min_size = min(min_size, int(item['min_size']['N']))
+        max_size = max(max_size, int(item['max_size']['N']))
+        sample_count += int(item.get('sample_count', {'N': '0'})['N'])
+
+    try:
+        dynamodb_client.update_item(
+            TableName=table_name,
+            Key=summary_key(bucket_name),
+            UpdateExpression=(
+                "SET min_size = :min_size, max_size = :max_size, sample_count = :count, backfilled = :true"
+            ),
+            ConditionExpression=(
+                "min_size = :old_min AND max_size = :old_max AND "
+                "(sample_count = :old_count OR attribute_not_exists(sample_count))"
+            ),
+            ExpressionAttributeValues={
+                ':min_size': {'N': str(min_size)},
+                ':max_size': {'N': str(max_size)},
+                ':count': {'N': str(max(sample_count, int(old_count['N'])))},
+                ':true': {'BOOL': True},
+                ':old_min': summary['min_size'],
+                ':old_max': summary['max_size'],
+                ':old_count': old_count
+            }
+        )
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def update_rollups_of_items(dynamodb_client, table_name, items):
+    """
+    Fold written history rows into the aggregates of their buckets, in the
+    order they were written. Rows that fail are logged and left out.
+    """
+    for item in items:
+        try:
+            update_rollups(dynamodb_client, table_name, item)
+        except Exception as e:
+            # the row is stored, only the aggregates miss this sample
+            logger.error("Error updating the rollups of %s: %s", bucket_from_partition_key(item['bucket_name']['S']), e)
+
+
+def get_summary(dynamodb_client, table_name, bucket_name):
+    """
+    Return the summary item of a bucket, with the min_size, max_size,
+    last_size, last_number_of_objects and last_timestamp of all its
+    snapshots, or None if no snapshot was summarized yet.
+    """
+    response = dynamodb_client.get_item(TableName=table_name, Key=summary_key(bucket_name))
+    return response.get('Item')
+
+
+def query_rollups(dynamodb_client, table_name, bucket_name, resolution, start_ms, end_ms=None):
+    """
+    Return the rollup items of a bucket whose period starts between two epoch
+    times in milliseconds, oldest first.
+    """
+    if end_ms is None:
+        end_ms = now_ms()
+    period_ms = ROLLUP_RESOLUTIONS[resolution]
+    return _query_partition(
+        dynamodb_client, table_name, rollup_partition_key(bucket_name, resolution),
+        start_ms // period_ms * period_ms, end_ms
+    )
+
+
+def _query_partition(dynamodb_client, table_name, key, start_ms, end_ms, descending=False, limit=None):
+    params = {
+        'TableName': table_name,
+        'KeyConditionExpression': "bucket_name = :bucket_name AND #ts BETWEEN :start AND :end",
+        'ExpressionAttributeNames': {"#ts": "timestamp"},
+        'ExpressionAttributeValues': {
+            ":bucket_name": {"S": key},
+            ":start": {"N": str(start_ms * SUFFIX_RANGE)},
+            ":end": {"N": str((end_ms + 1) * SUFFIX_RANGE - 1)}
+        },
+        'ScanIndexForward': not descending
+    }
+    if limit:
+        params['Limit'] = limit
+
+    items = []
+    while True:
+        response = dynamodb_client.query(**params)
+        items.extend(response['Items'])
+        if limit and len(items) >= limit:
+            return items[:limit]
+
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return items
+        params['ExclusiveStartKey'] = last_evaluated_key
+
+
+def _query_shards(dynamodb_client, table_name, bucket_name, shards, **kwargs):
+    keys = [partition_key(bucket_name, shard, shards) for shard in range(max(shards, 1))]
+    if len(keys) == 1:
+        return [_query_partition(dynamodb_client, table_name, keys[0], **kwargs)]
+
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        return list(executor.map(
+            lambda key: _query_partition(dynamodb_client, table_name, key, **kwargs), keys
+        ))
+
+
+def _sort_key(item):
+    return int(item['timestamp']['N'])
+
+
+def query_history(dynamodb_client, table_name, bucket_name, start_ms, end_ms=None, shards=1):
+    """
+    Return the history rows of a bucket between two epoch times in milliseconds
+    (inclusive), oldest first. Every shard is queried in parallel and the
+    results are merged. Reading with more shards than were written is harmless,
+    so readers can be configured with the largest shard count ever used.
+    """
+    if end_ms is None:
+        end_ms = now_ms()
+    shard_items = _query_shards(dynamodb_client, table_name, bucket_name, shards, start_ms=start_ms, end_ms=end_ms)
+    return list(heapq.merge(*shard_items, key=_sort_key))
+
+
+def get_latest_item(dynamodb_client, table_name, bucket_name, shards=1):
+    """
+    Return the newest history row of a bucket over all shards, or None.
+    """
+    shard_items = _query_shards(
+        dynamodb_client, table_name, bucket_name, shards,
+        start_ms=0, end_ms=now_ms(), descending=True, limit=1
+    )
+    items = [items[0] for items in shard_items if items]
+    return max(items, key=_sort_key, default=None)
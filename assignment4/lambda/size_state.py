@@ -0,0 +1,644 @@
+# per-object size state and running bucket totals for incremental size tracking
+import random
+import time
+
+import aws_clients
+import structured_log
+
+dynamodb_client = aws_clients.lazy_client('dynamodb')
+logger = structured_log.get_logger('size_state')
+
+# Totals live in their own partition next to the object items. S3 bucket names
+# cannot contain '#', so this partition never collides with a real bucket.
+TOTALS_PARTITION_SUFFIX = "#totals"
+TOTALS_SORT_KEY = "totals"
+
+
+# S3 sequencers are hex strings of varying length. Right-padded with zeros to a
+# fixed width they compare lexicographically in event order, which is the
+# comparison dynamodb applies to strings in condition expressions.
+SEQUENCER_WIDTH = 32
+
+
+def normalize_sequencer(sequencer):
+    return sequencer.upper().ljust(SEQUENCER_WIDTH, '0')
+
+
+# An event on an object reads the items it changes and writes them back, in
+# one transaction with the counter updates of the deltas it causes, on the
+# condition that they did not change since they were read. Every write bumps
+# the revision of the item; a conflicting writer reads again and retries. A
+# redelivered event finds its own sequencer stored and changes nothing.
+WRITE_ATTEMPTS = 5
+MAX_TRANSACTION_ITEMS = 100
+RETRYABLE_CANCELLATION_CODES = {'None', 'ConditionalCheckFailed', 'TransactionConflict'}
+
+
+def _get_item(table_name, key):
+    return dynamodb_client.get_item(TableName=table_name, Key=key, ConsistentRead=True).get('Item')
+
+
+def _unchanged_condition(old_item):
+    if not old_item:
+        return {'ConditionExpression': "attribute_not_exists(object_key)"}
+    if 'revision' in old_item:
+        return {
+            'ConditionExpression': "revision = :revision",
+            'ExpressionAttributeValues': {':revision': old_item['revision']}
+        }
+    # items written before revisions were kept
+    return {'ConditionExpression': "attribute_exists(object_key) AND attribute_not_exists(revision)"}
+
+
+def _put(table_name, item, old_item):
+    # transaction item replacing old_item, which may be None, by item
+    revision = int(old_item['revision']['N']) if old_item and 'revision' in old_item else 0
+    item['revision'] = {'N': str(revision + 1)}
+    return {'Put': dict({'TableName': table_name, 'Item': item}, **_unchanged_condition(old_item))}
+
+
+
+def _write(items):
+    """
+    Write transaction items, all or none. Returns False if an item changed
+    since it was read or another transaction got in the way.
+    """
+    try:
+        if len(items) == 1:
+            (action, params), = items[0].items()
+            write = {'Put': dynamodb_client.put_item, 'Update': dynamodb_client.update_item,
+                     'Delete': dynamodb_client.delete_item}[action]
+            write(**params)
+        else:
+            dynamodb_client.transact_write_items(TransactItems=items)
+    except (dynamodb_client.exceptions.ConditionalCheckFailedException,
+            dynamodb_client.exceptions.TransactionConflictException):
+        return False
+    except dynamodb_client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons', [])
+        if all(reason.get('Code') in RETRYABLE_CANCELLATION_CODES for reason in reasons):
+            return False
+        raise
+    return True
+
+
+def _apply(plan, counter_updates=None):
+    """
+    Call plan, which reads the items an event changes and returns its deltas
+    and the transaction items writing them, and write those items with the
+    counter updates of the deltas. Returns the deltas once written.
+    """
+    for attempt in range(WRITE_ATTEMPTS):
+        deltas, items = plan()
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if counter_updates and deltas:
+            items = items + counter_updates(deltas)
+        if not items or _write(items):
+            return deltas
+        time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+    raise RuntimeError(f"Items changed during {WRITE_ATTEMPTS} attempts to write them")
+
+
+def _is_newer(sequencer, old_item):
+    # events without a sequencer, and objects without one stored, are not ordered
+    if not sequencer or not old_item or 'sequencer' not in old_item:
+        return True
+    return normalize_sequencer(sequencer) > old_item['sequencer']['S']
+
+
+def _is_live(item):
+    # deleted objects keep a tombstone with their last sequencer but no size
+    return bool(item) and 'size' in item
+
+
+# The deltas of an event are a {totals attribute: delta} dict. bucket_size and
+# number_of_objects count the current versions only, noncurrent versions and
+# delete markers of versioned buckets are counted separately, and the
+# size_<storage class> attributes hold the bytes of every version per class.
+DEFAULT_STORAGE_CLASS = "STANDARD"
+
+
+STORAGE_CLASS_ATTRIBUTE_PREFIX = "size_"
+
+
+def storage_class_attribute(storage_class):
+    return STORAGE_CLASS_ATTRIBUTE_PREFIX + (storage_class or DEFAULT_STORAGE_CLASS)
+
+
+def add_deltas(deltas, other):
+    for name, delta in other.items():
+        deltas[name] = deltas.get(name, 0) + delta
+    return deltas
+
+
+def _storage_class(item):
+    return item.get('storage_class', {}).get('S', DEFAULT_STORAGE_CLASS)
+
+
+def _noncurrent_deltas(size, storage_class, sign=1):
+    return {
+        'noncurrent_size': sign * size,
+        'noncurrent_versions': sign,
+        storage_class_attribute(storage_class): sign * size
+    }
+
+
+def _version_partition_key(bucket_name, object_key):
+    return f"{bucket_name}#version#{object_key}"
+
+
+def _version_key(bucket_name, object_key, version_id):
+    return {
+        'bucket_name': {'S': _version_partition_key(bucket_name, object_key)},
+        'object_key': {'S': version_id}
+    }
+
+
+def _version_item(bucket_name, object_key, version_id, sequencer, size=None, storage_class=None):
+    # versions of versioned buckets are kept so a later permanent delete knows their size
+    item = _version_key(bucket_name, object_key, version_id)
+    item['sequencer'] = {'S': normalize_sequencer(sequencer or '')}
+    if size is None:
+        item['delete_marker'] = {'BOOL': True}
+    else:
+        item['size'] = {'N': str(size)}
+        item['storage_class'] = {'S': storage_class}
+    return item
+
+
+def _version_tombstone(version):
+    # a deleted version keeps its sequencer so a redelivered create finds it
+    return {key: version[key] for key in ('bucket_name', 'object_key', 'sequencer')}
+
+
+def _is_deleted_version(version):
+    return not _is_live(version) and not version.get('delete_marker', {}).get('BOOL')
+
+
+def _state_key(bucket_name, object_key):
+    return {'bucket_name': {'S': bucket_name}, 'object_key': {'S': object_key}}
+
+
+def _object_state_item(bucket_name, object_key, size=None, storage_class=None, version_id=None, sequencer=None):
+    item = _state_key(bucket_name, object_key)
+    if sequencer:
+        item['sequencer'] = {'S': normalize_sequencer(sequencer)}
+    if size is not None:
+        item['size'] = {'N': str(size)}
+        item['storage_class'] = {'S': storage_class}
+    if version_id:
+        item['version_id'] = {'S': version_id}
+    return item
+
+
+def record_object_size(table_name, bucket_name, object_key, size, sequencer=None,
+                       storage_class=DEFAULT_STORAGE_CLASS, version_id=None, counter_updates=None):
+    """
+    Store the new size of an object and return the deltas it causes. An
+    overwrite of an existing key only changes the size, and an event older
+    than the last one applied to the key changes nothing. In a versioned
+    bucket the previous current version becomes noncurrent instead of being
+    replaced, and a late event adds a noncurrent version.
+
+    counter_updates, see counter_updates(), adds the deltas to the running
+    totals in the same transaction as the state change.
+    """
+    storage_class = storage_class or DEFAULT_STORAGE_CLASS
+
+    def plan():
+        items = []
+        if version_id:
+            # the version is created with the state change, a redelivered event finds it
+            if _get_item(table_name, _version_key(bucket_name, object_key, version_id)):
+                logger.info("Ignoring known version %s of %s", version_id, object_key, category="record")
+                return {}, []
+            version = _version_item(bucket_name, object_key, version_id, sequencer, size, storage_class)
+            items.append(_put(table_name, version, None))
+
+        old_item = _get_item(table_name, _state_key(bucket_name, object_key))
+        if not _is_newer(sequencer, old_item):
+            if version_id:
+                logger.info("Out of order event for %s, counting version %s as noncurrent", object_key, version_id, category="record")
+                return _noncurrent_deltas(size, storage_class), items
+            logger.info("Ignoring out of order event for %s", object_key, category="record")
+            return {}, []
+
+        item = _object_state_item(bucket_name, object_key, size, storage_class, version_id, sequencer)
+        deltas = {'bucket_size': size, 'number_of_objects': 1, storage_class_attribute(storage_class): size}
+        if _is_live(old_item):
+            old_size = int(old_item['size']['N'])
+            if version_id:
+                # the previous version is still stored, only no longer current
+                add_deltas(deltas, {'noncurrent_size': old_size, 'noncurrent_versions': 1})
+            else:
+                add_deltas(deltas, {storage_class_attribute(_storage_class(old_item)): -old_size})
+            add_deltas(deltas, {'bucket_size': -old_size, 'number_of_objects': -1})
+        return deltas, items + [_put(table_name, item, old_item)]
+
+    return _apply(plan, counter_updates)
+
+
+def forget_object_size(table_name, bucket_name, object_key, sequencer=None, counter_updates=None):
+    """
+    Replace the stored size of a removed object with a tombstone and return
+    the deltas it causes. Removing a key we never saw, or an event older than
+    the last one applied to the key, changes nothing.
+    """
+    def plan():
+        old_item = _get_item(table_name, _state_key(bucket_name, object_key))
+        if not _is_newer(sequencer, old_item):
+            logger.info("Ignoring out of order event for %s", object_key, category="record")
+            return {}, []
+
+        deltas = {}
+        if _is_live(old_item):
+            old_size = int(old_item['size']['N'])
+            deltas = {
+                'bucket_size': -old_size,
+                'number_of_objects': -1,
+                storage_class_attribute(_storage_class(old_item)): -old_size
+            }
+        item = _object_state_item(bucket_name, object_key, sequencer=sequencer)
+        return deltas, [_put(table_name, item, old_item)]
+
+    return _apply(plan, counter_updates)
+
+
+def create_delete_marker(table_name, bucket_name, object_key, version_id, sequencer=None, counter_updates=None):
+    """
+    Record a delete marker of a versioned bucket and return the deltas it
+    causes: the current version, if any, becomes noncurrent.
+    """
+    def plan():
+        if _get_item(table_name, _version_key(bucket_name, object_key, version_id)):
+            logger.info("Ignoring known delete marker %s of %s", version_id, object_key, category="record")
+            return {}, []
+        items = [_put(table_name, _version_item(bucket_name, object_key, version_id, sequencer), None)]
+
+        old_item = _get_item(table_name, _state_key(bucket_name, object_key))
+        deltas = {'delete_markers': 1}
+        if not _is_newer(sequencer, old_item):
+            return deltas, items
+
+        if _is_live(old_item):
+            old_size = int(old_item['size']['N'])
+            add_deltas(deltas, {'bucket_size': -old_size, 'number_of_objects': -1})
+            add_deltas(deltas, {'noncurrent_size': old_size, 'noncurrent_versions': 1})
+        item = _object_state_item(bucket_name, object_key, version_id=version_id, sequencer=sequencer)
+        return deltas, items + [_put(table_name, item, old_item)]
+
+    return _apply(plan, counter_updates)
+
+
+def _newest_version(table_name, bucket_name, object_key, deleted_version_id):
+    response = dynamodb_client.query(
+        TableName=table_name,
+        KeyConditionExpression="bucket_name = :bucket_name",
+        ExpressionAttributeValues={":bucket_name": {"S": _version_partition_key(bucket_name, object_key)}},
+        ConsistentRead=True
+    )
+    remaining = [
+        item for item in response['Items']
+        if item['object_key']['S'] != deleted_version_id and not _is_deleted_version(item)
+    ]
+    return max(remaining, key=lambda item: item['sequencer']['S'], default=None)
+
+
+def delete_object_version(table_name, bucket_name, object_key, version_id, sequencer=None, counter_updates=None):
+    """
+    Permanently delete one version of an object in a versioned bucket and
+    return the deltas it causes. Deleting the current version makes the newest
+    remaining version current, as S3 does. The version is replaced with a
+    tombstone so a late create event for it changes nothing. Versions that
+    were created before tracking started are unknown and change nothing.
+    """
+    version_key = _version_key(bucket_name, object_key, version_id)
+
+    def plan():
+        version = _get_item(table_name, version_key)
+        if not version or _is_deleted_version(version):
+            logger.info("Ignoring delete of unknown version %s of %s", version_id, object_key, category="record")
+            return {}, []
+        if version.get('delete_marker', {}).get('BOOL'):
+            removed = {'delete_markers': -1}
+        else:
+            removed = _noncurrent_deltas(int(version['size']['N']), _storage_class(version), -1)
+
+        current = _get_item(table_name, _state_key(bucket_name, object_key))
+        if not current or current.get('version_id', {}).get('S') != version_id or not _is_newer(sequencer, current):
+            # a noncurrent version, or a newer event made it noncurrent in the meantime
+            return removed, [_put(table_name, _version_tombstone(version), version)]
+
+        # the deleted version was current: it was not counted as noncurrent
+        deltas = dict(removed)
+        if _is_live(current):
+            size = int(current['size']['N'])
+            add_deltas(deltas, {'noncurrent_size': size, 'noncurrent_versions': 1})
+            add_deltas(deltas, {'bucket_size': -size, 'number_of_objects': -1})
+
+        # promote the newest remaining version
+        newest = _newest_version(table_name, bucket_name, object_key, version_id)
+        if newest and _is_live(newest):
+            size = int(newest['size']['N'])
+            item = _object_state_item(
+                bucket_name, object_key, size, _storage_class(newest), newest['object_key']['S'], sequencer
+            )
+            add_deltas(deltas, {'noncurrent_size': -size, 'noncurrent_versions': -1})
+            add_deltas(deltas, {'bucket_size': size, 'number_of_objects': 1})
+        else:
+            item = _object_state_item(
+                bucket_name, object_key, version_id=newest and newest['object_key']['S'], sequencer=sequencer
+            )
+        return deltas, [_put(table_name, _version_tombstone(version), version), _put(table_name, item, current)]
+
+    return _apply(plan, counter_updates)
+
+
+def change_storage_class(table_name, bucket_name, object_key, storage_class, version_id=None, counter_updates=None):
+    """
+    Move an object version to another storage class, e.g. after a lifecycle
+    transition, and return the deltas it causes. Moving it to the class it is
+    in changes nothing.
+    """
+    key = _version_key(bucket_name, object_key, version_id) if version_id else _state_key(bucket_name, object_key)
+
+    def plan():
+        old_item = _get_item(table_name, key)
+        if not _is_live(old_item):
+            logger.info("Ignoring storage class change of unknown object %s", object_key, category="record")
+            return {}, []
+        if _storage_class(old_item) == storage_class:
+            return {}, []
+
+        items = [_put(table_name, dict(old_item, storage_class={'S': storage_class}), old_item)]
+        if version_id:
+            # keep the class of the current version in the object state too
+            current = _get_item(table_name, _state_key(bucket_name, object_key))
+            if current and current.get('version_id', {}).get('S') == version_id:
+                items.append(_put(table_name, dict(current, storage_class={'S': storage_class}), current))
+
+        size = int(old_item['size']['N'])
+        deltas = add_deltas(
+            {storage_class_attribute(_storage_class(old_item)): -size},
+            {storage_class_attribute(storage_class): size}
+        )
+        return deltas, items
+
+    return _apply(plan, counter_updates)
+
+
+def _totals_key(bucket_name, shard=None):
+    partition_key = bucket_name + TOTALS_PARTITION_SUFFIX
+    if shard is not None:
+        partition_key += f"#{shard}"
+    return {
+        'bucket_name': {'S': partition_key},
+        'object_key': {'S': TOTALS_SORT_KEY}
+    }
+
+
+# With sharded counters the totals of a bucket are spread over the
+# '<bucket>#totals#<i>' items next to the '<bucket>#totals' item, each in its
+# own partition so the writes are not throttled together. Writers add to one
+# random shard, readers sum the totals item and every shard in one transaction,
+# so at most 99 shards. The shard count can be raised at any time; before
+# lowering it, merge the shards that go away.
+
+
+def _add_expression(deltas):
+    # ADD clause for a deltas dict; names go through placeholders since some,
+    # like size, are reserved words
+    names, values, actions = {}, {}, []
+    for i, (name, delta) in enumerate(sorted(deltas.items())):
+        names[f"#a{i}"] = name
+        values[f":d{i}"] = delta if isinstance(delta, dict) else {'N': str(delta)}
+        actions.append(f"#a{i} :d{i}")
+    return "ADD " + ", ".join(actions), names, values
+
+
+def _get_totals_items(table_name, bucket_name, shards):
+    # one TransactGetItems of the totals item and the shards, so a read does not
+    # see a shard both before and after merge_totals_shards moved it
+    keys = [_totals_key(bucket_name)] + [_totals_key(bucket_name, shard) for shard in range(shards if shards > 1 else 0)]
+    return _transact_get(table_name, keys)
+
+
+def _transact_get(table_name, keys):
+    # a read is cancelled while a transaction writes one of its items, like a write
+    if len(keys) > MAX_TRANSACTION_ITEMS:
+        raise ValueError(f"Cannot read {len(keys)} items in one transaction, at most {MAX_TRANSACTION_ITEMS}")
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            response = dynamodb_client.transact_get_items(
+                TransactItems=[{'Get': {'TableName': table_name, 'Key': key}} for key in keys]
+            )
+            return [result['Item'] for result in response['Responses'] if result.get('Item')]
+        except dynamodb_client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if not all(reason.get('Code') in RETRYABLE_CANCELLATION_CODES for reason in reasons):
+                raise
+        time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+    raise RuntimeError(f"Items changed during {WRITE_ATTEMPTS} attempts to read them")
+
+
+def _counters(item):
+    return {name: value for name, value in item.items() if 'N' in value}
+
+
+def read_totals_breakdown(table_name, bucket_name, shards=1):
+    """
+    Return every running total of a bucket as a dict, summed over the totals
+    item and the counter shards: the current bucket_size and
+    number_of_objects, noncurrent_size, noncurrent_versions, delete_markers
+    and the size_<storage class> totals.
+    """
+    totals = {}
+    for item in _get_totals_items(table_name, bucket_name, shards):
+        add_deltas(totals, {name: int(value['N']) for name, value in _counters(item).items()})
+    return totals
+
+
+def read_totals(table_name, bucket_name, shards=1):
+    """
+    Return the (bucket_size, number_of_objects) of a bucket, summed over the
+    totals item and the counter shards.
+    """
+    totals = read_totals_breakdown(table_name, bucket_name, shards)
+    return totals.get('bucket_size', 0), totals.get('number_of_objects', 0)
+
+
+def merge_totals_shards(table_name, bucket_name, shards):
+    """
+    Fold the counter shards of a bucket into its totals item. Each shard is
+    moved in a transaction that only succeeds if the shard did not change in
+    the meantime, so the summed totals are the same before and after. Shards
+    that are being written to are left for the next merge.
+    """
+    merged = 0
+    for item in _get_totals_items(table_name, bucket_name, shards):
+        if item['bucket_name']['S'] == bucket_name + TOTALS_PARTITION_SUFFIX:
+            continue
+
+        counters = {name: value for name, value in _counters(item).items() if value['N'] != '0'}
+        if not counters:
+            continue
+
+        add_expression, names, values = _add_expression(counters)
+        values[':zero'] = {'N': '0'}
+        try:
+            dynamodb_client.transact_write_items(TransactItems=[
+                {'Update': {
+                    'TableName': table_name,
+                    'Key': {'bucket_name': item['bucket_name'], 'object_key': item['object_key']},
+                    'UpdateExpression': "SET " + ", ".join(f"{name} = :zero" for name in names),
+                    'ConditionExpression': " AND ".join(f"#a{i} = :d{i}" for i in range(len(names))),
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': values
+                }},
+                {'Update': {
+                    'TableName': table_name,
+                    'Key': _totals_key(bucket_name),
+                    'UpdateExpression': add_expression,
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': {name: value for name, value in values.items() if name != ':zero'}
+                }}
+            ])
+            merged += 1
+        except dynamodb_client.exceptions.TransactionCanceledException:
+            logger.warning("Shard %s of %s changed while merging, skipping", item['bucket_name']['S'], bucket_name)
+
+    return merged
+
+
+# Per-prefix totals form a trie over the '/' separated segments of the object
+# keys: each node is an item in the '<bucket>#prefix' partition whose sort key
+# is the prefix path, e.g. 'logs/' and 'logs/2024/'. The children of a node are
+# the items that begin with its path and have one segment more. With sharded
+# counters the nodes are sharded like the totals, into '<bucket>#prefix#<i>'
+# partitions, and written on the same shard as the totals of the event. They
+# are not merged, so the shard count cannot be lowered once prefixes are tracked.
+PREFIX_PARTITION_SUFFIX = "#prefix"
+
+
+def object_prefixes(object_key, depth):
+    """
+    Return the prefixes of an object key up to depth segments, shortest first.
+    'a/b/c.txt' with depth 2 gives ['a/', 'a/b/'].
+    """
+    segments = object_key.split('/')[:-1]
+    return ['/'.join(segments[:i]) + '/' for i in range(1, min(depth, len(segments)) + 1)]
+
+
+def _prefix_partition_key(bucket_name, shard=None):
+    partition_key = bucket_name + PREFIX_PARTITION_SUFFIX
+    if shard is not None:
+        partition_key += f"#{shard}"
+    return partition_key
+
+
+def _prefix_key(bucket_name, prefix, shard=None):
+    return {
+        'bucket_name': {'S': _prefix_partition_key(bucket_name, shard)},
+        'object_key': {'S': prefix}
+    }
+
+
+def counter_updates(table_name, bucket_name, object_key, shards=1, prefix_depth=0, storage_classes=True):
+    """
+    Return the counter_updates of the events on an object: a function turning
+    their deltas into the transaction items that add them to the running
+    totals of the bucket, on a random counter shard, and to the current size
+    and object count of every prefix of the key up to prefix_depth segments,
+    on the same shard.
+    The size_<storage class> totals are left out unless storage_classes is set.
+    """
+    def updates(deltas):
+        if not storage_classes:
+            deltas = {
+                name: delta for name, delta in deltas.items()
+                if not name.startswith(STORAGE_CLASS_ATTRIBUTE_PREFIX)
+            }
+            if not deltas:
+                return []
+        shard = random.randrange(shards) if shards > 1 else None
+        update_expression, names, values = _add_expression(deltas)
+        items = [{'Update': {
+            'TableName': table_name,
+            'Key': _totals_key(bucket_name, shard),
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }}]
+
+        # objects can move between prefixes even when the bucket totals do not change
+        current_deltas = {name: deltas[name] for name in ('bucket_size', 'number_of_objects') if deltas.get(name)}
+        if current_deltas:
+            update_expression, names, values = _add_expression(current_deltas)
+            for prefix in object_prefixes(object_key, prefix_depth):
+                items.append({'Update': {
+                    'TableName': table_name,
+                    'Key': _prefix_key(bucket_name, prefix, shard),
+                    'UpdateExpression': update_expression,
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': values
+                }})
+        return items
+
+    return updates
+
+
+def get_prefix_totals(table_name, bucket_name, prefix, depth, shards=1):
+    """
+    Return the (bucket_size, number_of_objects) stored for a prefix, or None
+    if the prefix is not tracked and has to be computed by listing. Tracked
+    prefixes are the empty prefix and those ending in '/' with at most depth
+    segments.
+    """
+    if not prefix:
+        return read_totals(table_name, bucket_name, shards)
+    if not prefix.endswith('/') or prefix.count('/') > depth:
+        return None
+
+    keys = [_prefix_key(bucket_name, prefix)] + [_prefix_key(bucket_name, prefix, shard) for shard in range(shards if shards > 1 else 0)]
+    totals = {}
+    for item in _transact_get(table_name, keys):
+        add_deltas(totals, {name: int(value['N']) for name, value in _counters(item).items()})
+    return totals.get('bucket_size', 0), totals.get('number_of_objects', 0)
+
+
+def list_child_prefixes(table_name, bucket_name, prefix="", shards=1):
+    """
+    Return the {child prefix: (bucket_size, number_of_objects)} of the tracked
+    prefixes one segment below a prefix, summed over the counter shards.
+    """
+    children = {}
+    for shard in [None] + list(range(shards if shards > 1 else 0)):
+        for child, (size, count) in _query_child_prefixes(table_name, _prefix_partition_key(bucket_name, shard), prefix):
+            old_size, old_count = children.get(child, (0, 0))
+            children[child] = (old_size + size, old_count + count)
+    return children
+
+
+def _query_child_prefixes(table_name, partition_key, prefix):
+    params = {
+        'TableName': table_name,
+        'KeyConditionExpression': "bucket_name = :bucket_name AND begins_with(object_key, :prefix)",
+        'ExpressionAttributeValues': {
+            ":bucket_name": {"S": partition_key},
+            ":prefix": {"S": prefix}
+        }
+    }
+    if not prefix:
+        params['KeyConditionExpression'] = "bucket_name = :bucket_name"
+        del params['ExpressionAttributeValues'][':prefix']
+
+    child_depth = prefix.count('/') + 1
+    while True:
+        response = dynamodb_client.query(**params)
+        for item in response['Items']:
+            child = item['object_key']['S']
+            if child.count('/') == child_depth:
+                yield child, (int(item['bucket_size']['N']), int(item['number_of_objects']['N']))
+        if not response.get('LastEvaluatedKey'):
+            return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -1,96 +1,386 @@
 # lambda function calculate bucket size and number of objects and store in dynamodb
-import boto3
-import datetime
 import json
 import os
+import time
 
-# Initialize the S3 and DynamoDB clients
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
+import aws_clients
+import batch_writer
+import bucket_lister
+import concurrency
+import idempotency
+import key_filter
+import s3_events
+import size_history
+import size_state
+import structured_log
+
+logger = structured_log.get_logger('size_tracking')
+
+# S3 and DynamoDB clients, created on first use
+s3_client = aws_clients.lazy_client('s3')
+dynamodb_client = aws_clients.lazy_client('dynamodb')
+
+# "incremental" applies the size delta carried by each S3 event to running totals,
+# "rescan" lists the whole bucket for every event
+TRACKING_MODE = os.environ.get('TRACKING_MODE', 'rescan')
+
+# number of prefix partitions listed concurrently in rescan mode
+LIST_WORKERS = int(os.environ.get('LIST_WORKERS', '8'))
+
+# number of partitions the history rows of one bucket are spread over
+HISTORY_SHARDS = int(os.environ.get('HISTORY_SHARDS', '1'))
+
+# raw history rows expire after this many seconds when set, the rollups keep the long range history
+HISTORY_TTL_SECONDS = int(os.environ.get('HISTORY_TTL_SECONDS', '0'))
+
+# number of counter shards the running totals of a bucket are spread over, for
+# buckets with more object events per second than a single item can take;
+# TOTALS_SHARDS_BY_BUCKET is a JSON object overriding it per bucket
+TOTALS_SHARDS = int(os.environ.get('TOTALS_SHARDS', '1'))
+TOTALS_SHARDS_BY_BUCKET = json.loads(os.environ.get('TOTALS_SHARDS_BY_BUCKET') or '{}')
+
+# the counter shards of a bucket are folded into its totals item at most this often per container
+TOTALS_MERGE_INTERVAL_SECONDS = int(os.environ.get('TOTALS_MERGE_INTERVAL_SECONDS', '300'))
+last_totals_merge = {}
+
+# per-prefix totals are kept for the first PREFIX_DEPTH segments of the object keys, 0 disables them
+PREFIX_DEPTH = int(os.environ.get('PREFIX_DEPTH', '0'))
+
+# the size_<storage class> totals need one HEAD request per created object,
+# since notifications of created objects do not carry the storage class
+TRACK_STORAGE_CLASSES = os.environ.get('TRACK_STORAGE_CLASSES', 'false').lower() == 'true'
+
+# S3 events already applied by this consumer are skipped, the store lives as long as the container
+CONSUMER_NAME = "size-tracking"
+DEDUP_TABLE_NAME = os.environ.get('DEDUP_TABLE_NAME')
+idempotency_store = idempotency.IdempotencyStore(DEDUP_TABLE_NAME, dynamodb_client) if DEDUP_TABLE_NAME else None
 
 def calculate_bucket_size_and_number_of_objects(bucket_name):
     try:
         total_size = 0
         total_objects = 0
-        objects = s3_client.list_objects_v2(Bucket=bucket_name)
-
-        for obj in objects.get('Contents', []):
-            object_key = obj['Key']
-            
-            # Ignore objects with the "plot/" prefix
-            if object_key.startswith("plot/"):
-                print(f"Ignoring plot file: {object_key}")
+
+        for obj in bucket_lister.iter_objects(s3_client, bucket_name, max_workers=LIST_WORKERS):
+            # Ignore objects excluded by the key rules, e.g. the "plot/" prefix
+            if not key_filter.is_included(obj['Key']):
                 continue
 
             total_size += obj['Size']
             total_objects += 1
-    
-        print(f"Bucket size: {total_size}, Number of objects: {total_objects}")
+
+        logger.info("Bucket size: %d, Number of objects: %d", total_size, total_objects, bucket=bucket_name)
         return total_size, total_objects
     except Exception as e:
-        print(f"Error calculating bucket size and number of objects: {e}")
+        logger.error("Error calculating bucket size and number of objects: %s", e, bucket=bucket_name)
         return None, None
 
-def store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name):
+def get_last_bucket_size_snapshot(bucket_name, table_name):
+    """
+    Return the (bucket_size, number_of_objects) of the newest stored snapshot,
+    or None if the bucket has no history yet.
+    """
+    # the summary item follows the newest snapshot, one read instead of one query per shard
+    summary = size_history.get_summary(dynamodb_client, table_name, bucket_name)
+    if summary:
+        return int(summary['last_size']['N']), int(summary['last_number_of_objects']['N'])
+
+    item = size_history.get_latest_item(dynamodb_client, table_name, bucket_name, HISTORY_SHARDS)
+    if not item:
+        return None
+    return int(item['bucket_size']['N']), int(item['number_of_objects']['N'])
+
+def put_bucket_size_snapshot(bucket_name, history_writer, bucket_size, number_of_objects, timestamp=None):
+    # current timestamp in epoch milliseconds, unless the caller took it when the size was read
+    timestamp = timestamp or size_history.now_ms()
+
+    # Log the data being written to DynamoDB
+    logger.info(
+        "Writing snapshot to DynamoDB", bucket=bucket_name, timestamp=timestamp,
+        bucket_size=bucket_size, number_of_objects=number_of_objects
+    )
+
+    # buffer the row, it is stored when the writer is flushed and then folded into the rollups
+    history_writer.put_item(size_history.make_history_item(
+        bucket_name, timestamp, bucket_size, number_of_objects, HISTORY_SHARDS, HISTORY_TTL_SECONDS
+    ))
+
+def store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name, history_writer):
+    # calculation
+    bucket_size, number_of_objects = calculate_bucket_size_and_number_of_objects(bucket_name)
+
+    if bucket_size is None or number_of_objects is None:
+        raise ValueError("Failed to calculate bucket size or number of objects")
+
+    # Skip the write if nothing changed since the last snapshot
+    if get_last_bucket_size_snapshot(bucket_name, table_name) == (bucket_size, number_of_objects):
+        logger.info("Size of %s unchanged, skipping snapshot", bucket_name)
+        return
+
+    put_bucket_size_snapshot(bucket_name, history_writer, bucket_size, number_of_objects)
+
+def get_storage_class(s3_record):
+    """
+    Return the storage class of the object version in an S3 event record.
+    Lifecycle transitions carry the class they moved the object to, created
+    objects are looked up with a HEAD request on the version.
+    """
+    if s3_record.storage_class:
+        return s3_record.storage_class
+
+    params = {'Bucket': s3_record.bucket, 'Key': s3_record.key}
+    if s3_record.version_id and s3_record.version_id != "null":
+        params['VersionId'] = s3_record.version_id
     try:
-        # calculation
-        bucket_size, number_of_objects = calculate_bucket_size_and_number_of_objects(bucket_name)
-
-        if bucket_size is None or number_of_objects is None:
-            raise ValueError("Failed to calculate bucket size or number of objects")
-        
-        # current timestamp
-        timestamp = str(datetime.datetime.now())
-
-        # Log the data being written to DynamoDB
-        print(f"Writing to DynamoDB: bucket_name={bucket_name}, timestamp={timestamp}, bucket_size={bucket_size}, number_of_objects={number_of_objects}")
-
-        # store data in dynamodb
-        dynamodb_client.put_item(
-            TableName=table_name,
-            Item={
-                'bucket_name': {'S': bucket_name},
-                'timestamp': {'S': timestamp},
-                'bucket_size': {'N': str(bucket_size)},
-                'number_of_objects': {'N': str(number_of_objects)}
-            }
+        # S3 leaves the header out for STANDARD
+        return s3_client.head_object(**params).get('StorageClass', size_state.DEFAULT_STORAGE_CLASS)
+    except s3_client.exceptions.ClientError as e:
+        # the version may be gone already, it is counted as STANDARD
+        logger.info("Error reading the storage class of %s: %s", s3_record.key, e, category="record")
+        return size_state.DEFAULT_STORAGE_CLASS
+
+def calculate_size_delta(s3_record, state_table_name):
+    """
+    Update the stored size of the object version in an S3 event record and
+    return the deltas the event causes for its bucket. The deltas are added to
+    the running totals and prefix totals in the same transaction.
+    """
+    event_name = s3_record.event_name
+    bucket_name = s3_record.bucket
+    object_key = s3_record.key
+    sequencer = s3_record.sequencer
+    # versioned buckets report a version id, unversioned ones none or "null"
+    version_id = s3_record.version_id
+    if version_id == "null":
+        version_id = None
+    counter_updates = size_state.counter_updates(
+        state_table_name, bucket_name, object_key, get_totals_shards(bucket_name), PREFIX_DEPTH, TRACK_STORAGE_CLASSES
+    )
+
+    if event_name.startswith("ObjectCreated"):
+        object_size = s3_record.size
+        return size_state.record_object_size(
+            state_table_name, bucket_name, object_key, object_size, sequencer,
+            get_storage_class(s3_record) if TRACK_STORAGE_CLASSES else None, version_id, counter_updates
         )
-        print(f"Stored {bucket_name} size and number of objects in {table_name} successfully!")
+
+    if event_name.endswith("DeleteMarkerCreated") and version_id:
+        return size_state.create_delete_marker(
+            state_table_name, bucket_name, object_key, version_id, sequencer, counter_updates
+        )
+
+    if event_name.startswith(("ObjectRemoved", "LifecycleExpiration")):
+        if version_id:
+            return size_state.delete_object_version(
+                state_table_name, bucket_name, object_key, version_id, sequencer, counter_updates
+            )
+        return size_state.forget_object_size(state_table_name, bucket_name, object_key, sequencer, counter_updates)
+
+    if event_name.startswith("LifecycleTransition") and TRACK_STORAGE_CLASSES:
+        return size_state.change_storage_class(
+            state_table_name, bucket_name, object_key, get_storage_class(s3_record), version_id, counter_updates
+        )
+
+    return {}
+
+def apply_size_deltas_in_dynamodb(bucket_name, s3_records, state_table_name, history_writer):
+    """
+    Apply the S3 event records of one bucket to the object states and running
+    totals, one transaction per record, and store one snapshot of the result.
+    """
+    # events on the same key are applied in order, different keys are independent
+    records_by_key = {}
+    for s3_record in s3_records:
+        records_by_key.setdefault(s3_record.key, []).append(s3_record)
+
+    def apply_key_records(key_records):
+        deltas = {}
+        for s3_record in key_records:
+            size_state.add_deltas(deltas, calculate_size_delta(s3_record, state_table_name))
+        return deltas
+
+    # a key whose records failed keeps the ones applied before the failure
+    deltas = {}
+    errors = []
+    for result in concurrency.run_all(apply_key_records, records_by_key.values()):
+        if isinstance(result, Exception):
+            errors.append(result)
+        else:
+            size_state.add_deltas(deltas, result)
+
+    logger.info("Applied deltas", bucket=bucket_name, events=len(s3_records), deltas=deltas)
+
+    # the history follows the current versions, noncurrent and storage class
+    # totals only live in the state table; skip the write if the events cancelled out
+    if not deltas.get('bucket_size') and not deltas.get('number_of_objects'):
+        logger.info("Size of %s unchanged, skipping snapshot", bucket_name)
+    else:
+        put_bucket_totals_snapshot(bucket_name, state_table_name, history_writer)
+
+    # each applied record wrote its state and counters together, so the
+    # redelivered events of the applied records are ignored by sequencer
+    if errors:
+        raise errors[0]
+
+def put_bucket_totals_snapshot(bucket_name, state_table_name, history_writer):
+    """
+    Store a snapshot of the running totals of a bucket. The totals include the
+    events of concurrent invocations, so the snapshot is placed at the time
+    they were read rather than at the time of the events of this batch; that
+    keeps the history in the order the totals took their values.
+    """
+    shards = get_totals_shards(bucket_name)
+    bucket_size, number_of_objects = size_state.read_totals(state_table_name, bucket_name, shards)
+    timestamp = size_history.now_ms()
+    put_bucket_size_snapshot(bucket_name, history_writer, bucket_size, number_of_objects, timestamp)
+
+    if shards > 1:
+        merge_totals_shards_periodically(bucket_name, state_table_name, shards)
+
+def get_totals_shards(bucket_name):
+    return int(TOTALS_SHARDS_BY_BUCKET.get(bucket_name, TOTALS_SHARDS))
+
+def merge_totals_shards_periodically(bucket_name, state_table_name, shards):
+    """
+    Fold the counter shards of a bucket into its totals item, if this
+    container has not done so within the merge interval.
+    """
+    now = time.monotonic()
+    if now - last_totals_merge.get(bucket_name, float('-inf')) < TOTALS_MERGE_INTERVAL_SECONDS:
+        return
+    last_totals_merge[bucket_name] = now
+
+    try:
+        merged = size_state.merge_totals_shards(state_table_name, bucket_name, shards)
+        logger.info("Merged %d counter shards of %s", merged, bucket_name)
     except Exception as e:
-        print(f"Error storing {bucket_name} size and number of objects in {table_name}: {e}")
+        # the totals are correct without the merge, it is retried next interval
+        logger.warning("Error merging counter shards of %s: %s", bucket_name, e)
 
-def lambda_handler(event, context):
-    table_name = os.environ['TABLE_NAME'] 
+def get_event_id(s3_record):
+    """
+    Return the id the event is deduplicated by, or None if it is not.
+    """
+    if idempotency_store and s3_record.sequencer:
+        return idempotency.s3_event_id(CONSUMER_NAME, s3_record.bucket, s3_record.key, s3_record.sequencer)
+    return None
 
-    # Process each message from the SQS queue
-    for record in event['Records']:
+def group_s3_records_by_bucket(event, failed_message_ids, event_ids_by_bucket):
+    """
+    Decode the S3 event records carried by a batch of SQS messages and group
+    them by bucket, in the order they were received. Returns the records and
+    the ids of the SQS messages they came from, per bucket. Messages that
+    cannot be decoded are added to failed_message_ids.
+
+    Events this consumer already processed are dropped; the ids of the events
+    claimed for processing are collected per bucket in event_ids_by_bucket.
+    """
+    # Decode each message from the SQS queue, dropping the objects excluded by
+    # the key rules so plot will not trigger SQS event
+    messages = []
+    for message_id, s3_records in s3_events.iter_messages(event):
         try:
-            # Parse the SQS message body
-            message_body = json.loads(record['body'])
-            print(f"Received SQS message: {message_body}")
+            included = []
+            for s3_record in s3_records:
+                if key_filter.is_included(s3_record.key):
+                    included.append(s3_record)
+                else:
+                    logger.debug("Ignoring excluded object: %s", s3_record.key, category="record")
+        except Exception as e:
+            logger.error("Error processing SQS message %s: %s", message_id, e)
+            failed_message_ids.add(message_id)
+            continue
+        messages.append((message_id, included))
 
-            # Parse the 'Message' field from the SNS message
-            sns_message = json.loads(message_body['Message'])
+    # Claim every event to skip those delivered more than once; the claims are
+    # independent writes and run concurrently in async mode. An event found in
+    # several messages of the batch belongs to the first one.
+    event_messages = {}
+    for message_id, s3_records in messages:
+        for s3_record in s3_records:
+            event_id = get_event_id(s3_record)
+            if event_id:
+                event_messages.setdefault(event_id, message_id)
+    claim_results = {}
+    if event_messages:
+        claim_results = dict(zip(event_messages, concurrency.run_all(idempotency_store.claim, event_messages)))
 
-            # Extract S3 event details
-            for s3_record in sns_message.get('Records', []):
-                bucket_name = s3_record['s3']['bucket']['name']
-                object_key = s3_record['s3']['object']['key']
+    records_by_bucket = {}
+    message_ids_by_bucket = {}
+    for message_id, s3_records in messages:
+        message_claims = {
+            event_id: claim_results[event_id] for event_id in map(get_event_id, s3_records)
+            if event_id and event_messages[event_id] == message_id
+        }
 
-                # Ignore objects with the "plot/" prefix, so plot will not trigger SQS event
-                if object_key.startswith("plot/"):
-                    print(f"Ignoring plot file: {object_key}")
+        errors = [result for result in message_claims.values() if isinstance(result, Exception)]
+        if errors:
+            logger.error("Error processing SQS message %s: %s", message_id, errors[0])
+            failed_message_ids.add(message_id)
+
+            # the whole message is retried, so its events must not stay claimed
+            idempotency_store.release(event_id for event_id, result in message_claims.items() if result is True)
+            continue
+
+        for s3_record in s3_records:
+            event_id = get_event_id(s3_record)
+            if event_id:
+                # duplicates, and events of another message of this batch, are skipped
+                if message_claims.pop(event_id, None) is not True:
                     continue
+                event_ids_by_bucket.setdefault(s3_record.bucket, []).append(event_id)
 
-                print(f"Processing object: {object_key} in bucket: {bucket_name}")
+            logger.info("Processing %r from message %s", s3_record, message_id, category="record")
+            records_by_bucket.setdefault(s3_record.bucket, []).append(s3_record)
+            message_ids_by_bucket.setdefault(s3_record.bucket, set()).add(message_id)
 
-                # Store bucket size and number of objects in DynamoDB
-                store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name)
+    return records_by_bucket, message_ids_by_bucket
 
-        except Exception as e:
-            print(f"Error processing SQS message: {e}")
+def lambda_handler(event, context):
+    table_name = os.environ['TABLE_NAME']
+    state_table_name = os.environ.get('STATE_TABLE_NAME')
+
+    # Only the messages listed here are returned to the queue for a retry
+    failed_message_ids = set()
+    event_ids_by_bucket = {}
+    records_by_bucket, message_ids_by_bucket = group_s3_records_by_bucket(
+        event, failed_message_ids, event_ids_by_bucket
+    )
+    failed_buckets = set()
+
+    # Snapshots are written in batches when the handler is done, and the
+    # minute/hour/day rollups are only updated for the rows that were written
+    def update_rollups(items):
+        size_history.update_rollups_of_items(dynamodb_client, table_name, items)
+
+    with batch_writer.BatchWriter(table_name, dynamodb_client, on_write=update_rollups) as history_writer:
+        # Compute every affected bucket once per batch
+        for bucket_name, s3_records in records_by_bucket.items():
+            try:
+                if TRACKING_MODE == "incremental":
+                    # Apply the size deltas of this batch to the running totals
+                    apply_size_deltas_in_dynamodb(bucket_name, s3_records, state_table_name, history_writer)
+                else:
+                    # Store bucket size and number of objects in DynamoDB
+                    store_bucket_size_and_number_of_objects_in_dynamodb(bucket_name, table_name, history_writer)
+            except Exception as e:
+                logger.error("Error updating size of %s in %s: %s", bucket_name, table_name, e)
+                failed_buckets.add(bucket_name)
+
+    # Snapshots that could not be written fail the messages of their bucket
+    failed_buckets.update(
+        size_history.bucket_from_partition_key(item['bucket_name']['S']) for item in history_writer.failed_items
+    )
+    for bucket_name in failed_buckets:
+        failed_message_ids.update(message_ids_by_bucket[bucket_name])
+
+    # Remember which events were applied, and let the failed ones be processed again
+    if idempotency_store:
+        for bucket_name, event_ids in event_ids_by_bucket.items():
+            if bucket_name in failed_buckets:
+                idempotency_store.release(event_ids)
+            else:
+                idempotency_store.complete(event_ids)
 
     return {
-        'statusCode': 200,
-        'body': 'Bucket size and object count updated in DynamoDB.'
-    }
\ No newline at end of file
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed_message_ids)]
+    }
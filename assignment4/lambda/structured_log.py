@@ -0,0 +1,86 @@
+# structured, leveled and sampled logging shared by the lambdas
+import json
+import os
+import random
+import sys
+import time
+import traceback
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# lines below this level are dropped before their message is formatted
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# fraction of the lines of a category that are written, so per record lines
+# can stay on without one line per event; categories not listed are always
+# written, and warnings and errors are never sampled. LOG_SAMPLE_RATES is a
+# JSON object overriding the defaults, e.g. {"record": 0.1}
+DEFAULT_SAMPLE_RATES = {"record": 0.01}
+LOG_SAMPLE_RATES = dict(DEFAULT_SAMPLE_RATES, **json.loads(os.environ.get('LOG_SAMPLE_RATES') or '{}'))
+
+_loggers = {}
+
+
+class Logger:
+    """
+    Writes one JSON line per message to stdout, which lambda forwards to the
+    function's log group. Messages use %-style arguments and field values may
+    be callables; both are only evaluated when the line is written.
+    """
+
+    def __init__(self, name, level=None, sample_rates=None):
+        self.name = name
+        self.level = LEVELS[(level or LOG_LEVEL).upper()]
+        self.sample_rates = LOG_SAMPLE_RATES if sample_rates is None else sample_rates
+        self.bytes_written = 0
+
+    def enabled(self, level, category=None):
+        if LEVELS[level] < self.level:
+            return False
+        if category is None or LEVELS[level] >= LEVELS["WARNING"]:
+            return True
+        rate = self.sample_rates.get(category, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+    def log(self, level, message, *args, category=None, **fields):
+        if not self.enabled(level, category):
+            return
+        line = {
+            "time": round(time.time(), 3),
+            "level": level,
+            "logger": self.name,
+            "message": message % args if args else message
+        }
+        if category:
+            line["category"] = category
+        for field, value in fields.items():
+            line[field] = value() if callable(value) else value
+        text = json.dumps(line, separators=(',', ':'), default=str) + "\n"
+        sys.stdout.write(text)
+        self.bytes_written += len(text)
+
+    def debug(self, message, *args, **fields):
+        self.log("DEBUG", message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log("INFO", message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log("WARNING", message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log("ERROR", message, *args, **fields)
+
+    def exception(self, message, *args, **fields):
+        # only call from an except block, the traceback of the handled exception is attached
+        self.log("ERROR", message, *args, traceback=traceback.format_exc, **fields)
+
+
+def get_logger(name):
+    """
+    Return the logger of a module, created with the LOG_LEVEL and
+    LOG_SAMPLE_RATES of the environment.
+    """
+    if name not in _loggers:
+        _loggers[name] = Logger(name)
+    return _loggers[name]
@@ -0,0 +1,98 @@
+# microbenchmark of decoding SQS batches of SNS-wrapped S3 events
+# usage: python tools/bench_s3_events.py [--messages 10] [--records 100] [--repeat 20]
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+import s3_events
+
+
+def make_event(messages, records):
+    """
+    Build a lambda event of SQS messages, each an SNS notification carrying
+    an S3 event with the given number of records.
+    """
+    sqs_records = []
+    for m in range(messages):
+        s3_records = [{
+            "eventVersion": "2.1",
+            "eventSource": "aws:s3",
+            "awsRegion": "us-west-2",
+            "eventTime": "2024-03-01T12:00:00.123Z",
+            "eventName": "ObjectCreated:Put",
+            "userIdentity": {"principalId": "AWS:EXAMPLE"},
+            "requestParameters": {"sourceIPAddress": "127.0.0.1"},
+            "responseElements": {"x-amz-request-id": "EXAMPLE", "x-amz-id-2": "EXAMPLE"},
+            "s3": {
+                "s3SchemaVersion": "1.0",
+                "configurationId": "notification",
+                "bucket": {"name": "test-bucket", "ownerIdentity": {"principalId": "EXAMPLE"},
+                           "arn": "arn:aws:s3:::test-bucket"},
+                "object": {"key": f"data/{m}/object-{r}.txt", "size": 1024 + r, "eTag": "0" * 32,
+                           "sequencer": f"{m * records + r:016X}"}
+            }
+        } for r in range(records)]
+        body = json.dumps({
+            "Type": "Notification",
+            "MessageId": f"sns-{m}",
+            "TopicArn": "arn:aws:sns:us-west-2:123456789012:topic",
+            "Message": json.dumps({"Records": s3_records}),
+            "Timestamp": "2024-03-01T12:00:00.456Z"
+        })
+        sqs_records.append({"messageId": f"message-{m}", "body": body})
+    return {"Records": sqs_records}
+
+
+def decode_nested_json(event):
+    # what the handlers did before: two json.loads and dict lookups per record
+    total = 0
+    for record in event["Records"]:
+        message_body = json.loads(record["body"])
+        sns_message = json.loads(message_body["Message"])
+        for s3_record in sns_message.get("Records", []):
+            total += s3_record["s3"]["object"].get("size", 0)
+            s3_record["s3"]["bucket"]["name"], s3_record["s3"]["object"]["key"]
+    return total
+
+
+def decode_records(event):
+    total = 0
+    for _, s3_records in s3_events.iter_messages(event):
+        for s3_record in s3_records:
+            total += s3_record.size
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time decoding of SQS batches of S3 events")
+    parser.add_argument("--messages", type=int, default=10, help="SQS messages per batch")
+    parser.add_argument("--records", type=int, default=100, help="S3 records per message")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per decoder")
+    args = parser.parse_args()
+
+    event = make_event(args.messages, args.records)
+    records = args.messages * args.records
+    print(f"{args.messages} messages x {args.records} records, json backend: {s3_events.loads.__module__}")
+
+    candidates = [("nested json.loads", decode_nested_json), ("s3_events", decode_records)]
+    if s3_events.loads is not json.loads:
+        # the same decoder with the standard library backend
+        def decode_records_stdlib(event):
+            s3_events.loads, fast_loads = json.loads, s3_events.loads
+            try:
+                return decode_records(event)
+            finally:
+                s3_events.loads = fast_loads
+        candidates.append(("s3_events (json)", decode_records_stdlib))
+
+    for name, decode in candidates:
+        best = min(timeit.repeat(lambda: decode(event), number=1, repeat=args.repeat))
+        print(f"{name:20s} {best * 1000:8.2f} ms/batch {best / records * 1e6:8.2f} us/record")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# report the import time of every lambda handler module, to track cold starts
+# usage: python tools/import_time.py [--budget-ms 250] [--top 5] [module ...]
+# covers the handlers of assignment4 and of the midterm, which share aws_clients.py
+import argparse
+import glob
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+LAMBDA_DIRS = {
+    "assignment4": os.path.join(REPO_DIR, "assignment4", "lambda"),
+    "midterm": os.path.join(REPO_DIR, "midterm", "lambda"),
+}
+
+# the handlers read these at import time; the values are never used to call AWS
+HANDLER_ENV = {
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "TABLE_NAME": "import-time",
+    "STATE_TABLE_NAME": "import-time",
+    "S3_BUCKET_NAME": "import-time",
+    "TEST_BUCKET": "import-time",
+    "SRC_BUCKET": "import-time",
+    "DEST_BUCKET": "import-time",
+    "DYNAMO_TABLE": "import-time",
+}
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def handler_modules(names=None):
+    """
+    Return the (lambda directory, module) of every handler, or of the
+    handlers with the given module names.
+    """
+    modules = []
+    for lambda_dir in LAMBDA_DIRS.values():
+        for path in sorted(glob.glob(os.path.join(lambda_dir, "*_lambda.py"))):
+            module = os.path.basename(path)[:-3]
+            if not names or module in names:
+                modules.append((lambda_dir, module))
+    return modules
+
+
+def measure(lambda_dir, module):
+    """
+    Import a module in a fresh interpreter with -X importtime and return its
+    cumulative import time in microseconds and the (self time, name) of every
+    module it pulled in.
+    """
+    env = dict(os.environ, **{name: os.environ.get(name, value) for name, value in HANDLER_ENV.items()})
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=lambda_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    total, imports = 0, []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        imports.append((int(self_us), name))
+        if name == module:
+            total = int(cumulative_us)
+    return total, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time of the lambda handler modules")
+    parser.add_argument("modules", nargs="*", help="modules to measure, all *_lambda modules by default")
+    parser.add_argument("--budget-ms", type=float, default=250,
+                        help="exit with an error if a module takes longer to import, 250 by default")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list per module")
+    args = parser.parse_args()
+
+    over_budget = []
+    for lambda_dir, module in handler_modules(args.modules):
+        name = f"{os.path.basename(os.path.dirname(os.path.abspath(lambda_dir)))}/{module}"
+        try:
+            total, imports = measure(lambda_dir, module)
+        except RuntimeError as e:
+            print(e)
+            over_budget.append(name)
+            continue
+
+        print(f"{name:36s} {total / 1000:8.1f} ms")
+        for self_us, imported in sorted(imports, reverse=True)[:args.top]:
+            print(f"    {self_us / 1000:8.1f} ms  {imported}")
+
+        if total / 1000 > args.budget_ms:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"Over the import budget of {args.budget_ms:g} ms: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
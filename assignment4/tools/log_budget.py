@@ -0,0 +1,128 @@
+# check the bytes the event driven lambdas log per S3 event against a budget
+# usage: python tools/log_budget.py [--messages 10] [--records 20] [--budget-bytes 200] [handler ...]
+# requires moto, the handlers run against in-memory DynamoDB tables
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS_DIR, "..", "lambda"))
+sys.path.insert(0, TOOLS_DIR)
+
+from bench_s3_events import make_event
+
+# table names of the environment the handlers are imported with, see StorageStack
+HANDLER_ENV = {
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "AWS_ACCESS_KEY_ID": "log-budget",
+    "AWS_SECRET_ACCESS_KEY": "log-budget",
+    "TABLE_NAME": "size-history",
+    "STATE_TABLE_NAME": "size-state",
+    "SIZE_INDEX_TABLE_NAME": "size-index",
+    "DEDUP_TABLE_NAME": "event-dedup",
+    "TRACKING_MODE": "incremental",
+    "EXECUTION_MODE": "sync",
+}
+
+TABLES = {
+    "size-history": [("bucket_name", "S"), ("timestamp", "N")],
+    "size-state": [("bucket_name", "S"), ("object_key", "S")],
+    "size-index": [("bucket_name", "S"), ("object_key", "S")],
+    "event-dedup": [("event_id", "S")],
+}
+
+HANDLERS = ["size_tracking_lambda", "logging_lambda"]
+
+
+def create_tables(dynamodb):
+    for table_name, keys in TABLES.items():
+        dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[
+                {"AttributeName": name, "KeyType": key_type}
+                for (name, _), key_type in zip(keys, ["HASH", "RANGE"])
+            ],
+            AttributeDefinitions=[{"AttributeName": name, "AttributeType": type_} for name, type_ in keys],
+            BillingMode="PAY_PER_REQUEST"
+        )
+
+
+def make_delete_event(create_event, sequencer_offset):
+    """
+    Turn a batch of create events into the deletes of the same objects.
+    """
+    event = copy.deepcopy(create_event)
+    for sqs_record in event["Records"]:
+        notification = json.loads(sqs_record["body"])
+        message = json.loads(notification["Message"])
+        for s3_record in message["Records"]:
+            s3_record["eventName"] = "ObjectRemoved:Delete"
+            s3_object = s3_record["s3"]["object"]
+            s3_object.pop("size", None)
+            s3_object["sequencer"] = f"{int(s3_object['sequencer'], 16) + sequencer_offset:016X}"
+        notification["Message"] = json.dumps(message)
+        sqs_record["body"] = json.dumps(notification)
+        sqs_record["messageId"] += "-delete"
+    return event
+
+
+def measure(handler, events, event_count):
+    """
+    Run the batches through the handler and return the bytes it wrote to
+    stdout per S3 event.
+    """
+    module = __import__(handler)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for event in events:
+            module.lambda_handler(event, None)
+    return len(output.getvalue().encode()) / event_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the bytes logged per S3 event by the lambda handlers")
+    parser.add_argument("handlers", nargs="*", help=f"handlers to run, {', '.join(HANDLERS)} by default")
+    parser.add_argument("--messages", type=int, default=10, help="SQS messages per batch")
+    parser.add_argument("--records", type=int, default=20, help="S3 event records per message")
+    parser.add_argument("--budget-bytes", type=float, default=200,
+                        help="exit with an error if a handler logs more per event, 200 by default")
+    args = parser.parse_args()
+
+    for name, value in HANDLER_ENV.items():
+        os.environ.setdefault(name, value)
+
+    try:
+        from moto import mock_aws
+    except ImportError:
+        sys.exit("log_budget.py needs moto: pip install moto")
+
+    # sampled categories log the same lines on every run
+    random.seed(0)
+
+    create_event = make_event(args.messages, args.records)
+    events = [create_event, make_delete_event(create_event, args.messages * args.records)]
+    event_count = 2 * args.messages * args.records
+
+    over_budget = []
+    for handler in args.handlers or HANDLERS:
+        with mock_aws():
+            import boto3
+            create_tables(boto3.client("dynamodb"))
+            bytes_per_event = measure(handler, events, event_count)
+
+        print(f"{handler:24s} {bytes_per_event:8.1f} bytes per event")
+        if bytes_per_event > args.budget_bytes:
+            over_budget.append(handler)
+
+    if over_budget:
+        print(f"Over the log budget of {args.budget_bytes:g} bytes per event: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
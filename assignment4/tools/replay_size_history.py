@@ -0,0 +1,197 @@
+# rebuild the size history of buckets from exported logging lambda logs
+# usage: python tools/replay_size_history.py --table <history table> [--bucket <name>] [--dry-run] file ...
+#
+# Reads the per object {"object_name", "size_delta"} lines the logging lambda
+# used to write and the TotalObjectSize EMF documents it writes per batch, from
+# plain or gzip compressed log exports. The legacy lines do not name the
+# bucket, --bucket does.
+import argparse
+import datetime
+import gzip
+import heapq
+import mmap
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+import aws_clients
+import batch_writer
+import size_history
+from s3_events import loads
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# every line of an export starts with the time it was logged
+ISO_TIME = re.compile(rb"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)Z")
+
+
+def iter_lines(path):
+    """
+    Yield the lines of a log file as bytes. Plain files are memory mapped,
+    gzip files are decompressed as they are read.
+    """
+    with open(path, "rb") as f:
+        if f.read(2) == GZIP_MAGIC:
+            f.seek(0)
+            with gzip.open(f) as lines:
+                yield from lines
+            return
+
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter(mm.readline, b"")
+
+
+def line_time_ms(line):
+    match = ISO_TIME.search(line)
+    if not match:
+        return None
+    logged_at = datetime.datetime.fromisoformat(match.group(1).decode())
+    return round(logged_at.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def parse_line(line, default_bucket):
+    """
+    Return (bucket, epoch ms, size delta, object name) for a size line, or
+    None for any other line. EMF documents carry no object name.
+    """
+    # cheap substring checks skip the JSON decoding of unrelated lines
+    if b'"size_delta"' in line:
+        kind = "legacy"
+    elif b'"TotalObjectSize"' in line:
+        kind = "emf"
+    else:
+        return None
+
+    start = line.find(b"{")
+    try:
+        document = loads(line[start:])
+    except ValueError:
+        return None
+
+    if kind == "emf":
+        timestamp = document.get("_aws", {}).get("Timestamp") or line_time_ms(line)
+        return document.get("BucketName"), timestamp, int(document["TotalObjectSize"]), None
+
+    return default_bucket, line_time_ms(line), int(document["size_delta"]), document.get("object_name")
+
+
+def parse_file(path, default_bucket):
+    """
+    Return the size lines of one file summed per bucket and time, and the
+    number of size lines skipped because their bucket or time is unknown.
+    The sums are (epoch ms, bucket, size delta, {object name: size delta})
+    tuples sorted by time, so the files can be merged without sorting again.
+    """
+    sums, skipped = {}, 0
+    for line in iter_lines(path):
+        parsed = parse_line(line, default_bucket)
+        if parsed is None:
+            continue
+        bucket, timestamp, delta, object_name = parsed
+        if bucket is None or timestamp is None:
+            skipped += 1
+            continue
+        summed = sums.setdefault((timestamp, bucket), [0, {}])
+        summed[0] += delta
+        if object_name is not None:
+            summed[1][object_name] = summed[1].get(object_name, 0) + delta
+    return [(timestamp, bucket, size_delta, object_deltas)
+            for (timestamp, bucket), (size_delta, object_deltas) in sorted(sums.items())], skipped
+
+
+def build_series(sums, start_size=0, start_objects=0):
+    """
+    Replay the summed size deltas of parse_file, in time order, and return
+    per bucket the (epoch ms, bucket size, number of objects) after every
+    distinct time. The number of objects follows the named objects whose
+    running size is positive, deltas of EMF documents only change the size.
+    """
+    series = {}
+    totals = {}
+    object_sizes = {}
+    for timestamp, bucket, delta, object_deltas in sums:
+        size, objects = totals.get(bucket, (start_size, start_objects))
+        size += delta
+
+        for object_name, object_delta in object_deltas.items():
+            old_size = object_sizes.get((bucket, object_name), 0)
+            new_size = old_size + object_delta
+            object_sizes[(bucket, object_name)] = new_size
+            objects += (new_size > 0) - (old_size > 0)
+
+        totals[bucket] = (size, objects)
+
+        points = series.setdefault(bucket, [])
+        if points and points[-1][0] == timestamp:
+            points[-1] = (timestamp, size, objects)
+        else:
+            points.append((timestamp, size, objects))
+    return series
+
+
+def load_series(series, table_name, shards, rollups):
+    dynamodb_client = aws_clients.client("dynamodb")
+
+    # the rollups fold in the written rows; they skip points older than their
+    # last sample, so loading the same series twice counts it once
+    def update_rollups(items):
+        size_history.update_rollups_of_items(dynamodb_client, table_name, items)
+
+    with batch_writer.BatchWriter(table_name, dynamodb_client, on_write=update_rollups if rollups else None) as writer:
+        for bucket, points in series.items():
+            for timestamp, size, objects in points:
+                writer.put_item(size_history.make_history_item(bucket, timestamp, size, objects, shards))
+    return writer.failed_items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the size history table from logging lambda logs")
+    parser.add_argument("files", nargs="+", help="exported log files, plain or gzip compressed")
+    parser.add_argument("--table", help="history table to load the rebuilt rows into")
+    parser.add_argument("--bucket", help="bucket of the legacy size_delta lines, which do not name it")
+    parser.add_argument("--shards", type=int, default=1, help="HISTORY_SHARDS of the size tracking lambda")
+    parser.add_argument("--start-size", type=int, default=0, help="bucket size before the first line")
+    parser.add_argument("--start-objects", type=int, default=0, help="number of objects before the first line")
+    parser.add_argument("--skip-rollups", action="store_true", help="only write the raw history rows")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="files parsed in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="print the rebuilt series instead of loading it")
+    args = parser.parse_args()
+
+    if not args.dry_run and not args.table:
+        parser.error("--table is required unless --dry-run is given")
+
+    # every worker returns the sorted sums of its file, merged here in time order
+    file_sums, skipped = [], 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for sums, file_skipped in pool.map(parse_file, args.files, [args.bucket] * len(args.files)):
+            file_sums.append(sums)
+            skipped += file_skipped
+
+    if skipped:
+        print(f"Skipped {skipped} size lines without a bucket or time, see --bucket")
+
+    merged = heapq.merge(*file_sums, key=lambda s: s[0])
+    series = build_series(merged, args.start_size, args.start_objects)
+    for bucket, points in series.items():
+        first, last = points[0], points[-1]
+        print(f"{bucket}: {len(points)} points from {first[0]} to {last[0]}, final size {last[1]}, {last[2]} objects")
+        if args.dry_run:
+            for timestamp, size, objects in points:
+                print(f"    {timestamp} {size} {objects}")
+
+    if args.dry_run:
+        return
+
+    failed_items = load_series(series, args.table, args.shards, not args.skip_rollups)
+    if failed_items:
+        print(f"Failed to write {len(failed_items)} history rows")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
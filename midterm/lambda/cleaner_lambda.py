@@ -1,14 +1,23 @@
+import functools
 import os
 import time
-import boto3
-from boto3.dynamodb.conditions import Key
 
-s3 = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+import aws_clients
+
 dst_bucket = os.environ['DEST_BUCKET']
-table = dynamodb.Table(os.environ["DYNAMO_TABLE"])
+
+# clients are created on first use by the shared factory and reused by later invocations
+def get_s3():
+    return aws_clients.client("s3")
+
+@functools.lru_cache(maxsize=None)
+def get_table():
+    return aws_clients.resource("dynamodb").Table(os.environ["DYNAMO_TABLE"])
 
 def lambda_handler(event, context):
+    # imported here, a module level import would load boto3 on every cold start
+    from boto3.dynamodb.conditions import Key
+
     current_time = int(time.time())
     expiry_time = current_time - 10
 
@@ -21,15 +30,15 @@ def lambda_handler(event, context):
         if last_evaluated_key:
             query_params["ExclusiveStartKey"] = last_evaluated_key
 
-        response = table.query(**query_params)
+        response = get_table().query(**query_params)
 
         # Delete S3 objects and DynamoDB entries
         for item in response.get("Items", []):
             try:
                 # Delete from S3
-                s3.delete_object(Bucket=dst_bucket, Key=item["DstObjName"])
+                get_s3().delete_object(Bucket=dst_bucket, Key=item["DstObjName"])
                 # Delete from DynamoDB
-                table.delete_item(
+                get_table().delete_item(
                     Key={
                         "SrcObjName": item["SrcObjName"],
                         "CreatedAtTimestamp": item["CreatedAtTimestamp"],
@@ -1,12 +1,18 @@
+import functools
 import os
 import time
-import boto3
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+import aws_clients
 
 dst_bucket = os.environ['DEST_BUCKET']
-table = dynamodb.Table(os.environ['DYNAMO_TABLE'])
+
+# clients are created on first use by the shared factory and reused by later invocations
+def get_s3():
+    return aws_clients.client('s3')
+
+@functools.lru_cache(maxsize=None)
+def get_table():
+    return aws_clients.resource('dynamodb').Table(os.environ['DYNAMO_TABLE'])
 
 def lambda_handler(event, context): # handle trigger from src bucket
     for record in event['Records']:
@@ -29,14 +35,14 @@ def handle_put_event(src_bucket, src_key):
     timestamp = int(time.time())
     dst_key = f"{src_key}-{timestamp}"
 
-    s3.copy_object(
+    get_s3().copy_object(
         CopySource={'Bucket': src_bucket, 'Key': src_key},
         Bucket=dst_bucket,
         Key=dst_key
     )
 
     # query existing copies in des bucket
-    response = table.query(
+    response = get_table().query(
         KeyConditionExpression='SrcObjName = :src',
         ExpressionAttributeValues={':src': src_key}
     )
@@ -46,7 +52,7 @@ def handle_put_event(src_bucket, src_key):
     if len(items) >= 3:
         oldest_item = sorted(items, key=lambda x: x['CreatedAtTimestamp'])[0]
         # table.delete_item(Key={'SrcObjName': oldest_item['SrcObjName'], 'CreatedAtTimestamp': oldest_item['CreatedAtTimestamp']})
-        table.update_item(
+        get_table().update_item(
             Key={
                 'SrcObjName': oldest_item['SrcObjName'],
                 'CreatedAtTimestamp': oldest_item['CreatedAtTimestamp']
@@ -59,7 +65,7 @@ def handle_put_event(src_bucket, src_key):
         )
 
     # insert a new copy record into the dynamodb table
-    table.put_item(Item={
+    get_table().put_item(Item={
         'SrcObjName': src_key,
         'CreatedAtTimestamp': timestamp,
         'DstObjName': dst_key,
@@ -69,14 +75,14 @@ def handle_put_event(src_bucket, src_key):
 
 def handle_delete_event(src_key):
     # get the deleted copies
-    response = table.query(
+    response = get_table().query(
         KeyConditionExpression='SrcObjName = :src',
         ExpressionAttributeValues={':src': src_key}
     )
     items = response.get('Items', [])
     for item in items:
         # mark each deleted copies as disowned(1)
-        table.update_item(
+        get_table().update_item(
             Key={'SrcObjName': item['SrcObjName'], 'CreatedAtTimestamp': item['CreatedAtTimestamp']},
             UpdateExpression='SET IsDisowned = :disowned, DisownedAtTimestamp = :time',
             ExpressionAttributeValues={